@@ -0,0 +1,18 @@
+import os
+import threading
+
+# Cloud Run settings: one process serving requests on threads; Cloud Run enforces the timeout
+bind = f":{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 0
+
+# Set WARM_ON_START=0 to skip the background warm-up, e.g. when measuring cold start
+WARM_ON_START = os.environ.get('WARM_ON_START', '1') != '0'
+
+
+def post_worker_init(worker):
+    # The app is imported by now; load the heavy SDKs while the worker waits for traffic
+    if WARM_ON_START:
+        from main import warm_up
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
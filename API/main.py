@@ -1,10 +1,16 @@
+# Imported first so the startup profile covers everything below
+import startup
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 import certifi
-from google.cloud import storage
-import json
+from typing import Optional
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from pydantic import BaseModel, ValidationError
+import request_log
+from mapping_store import MappingConflict, cache as mapping_cache, read_mapping, write_mapping
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000"])
@@ -16,6 +22,20 @@ os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
 BUCKET_NAME = "snow_function"
 FILE_NAME = "mapping.json"
 
+# Batch uploads: most mappings accepted per call and concurrent GCS writes across all batches
+MAX_BATCH_MAPPINGS = int(os.environ.get('MAX_BATCH_MAPPINGS', 1000))
+MAPPING_UPLOAD_WORKERS = int(os.environ.get('MAPPING_UPLOAD_WORKERS', 16))
+# Object keys are paths inside BUCKET_NAME, e.g. mappings/NODE/Node_with_IP.json
+OBJECT_KEY_PATTERN = re.compile(r'^(?!/)(?!.*\.\.)[A-Za-z0-9_.\-/]+\.json$')
+
+upload_executor = ThreadPoolExecutor(max_workers=MAPPING_UPLOAD_WORKERS, thread_name_prefix='mapping-upload')
+
+# Imported on first upload; loaded ahead of traffic by the gunicorn hook and /healthz
+WARM_MODULES = ['google.cloud.storage']
+
+def warm_up():
+    startup.warm(WARM_MODULES)
+
 class MappingData(BaseModel):
     gbq_output_table: str
     project_id: str
@@ -24,9 +44,25 @@ class MappingData(BaseModel):
     delimiter: str
     gbq_write_mode: str
     overwrite: bool = True
+    # Only replace the mapping if it is still at this generation (from an earlier upload's response)
+    if_generation_match: Optional[int] = None
+
+class MappingItem(MappingData):
+    # Where this mapping is written in BUCKET_NAME
+    object_key: str
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization, X-Requested-With',
+    'Access-Control-Max-Age': '3600',
+}
+
+# Structured request log; payload fields the model marks as credentials are redacted
+request_log.install(app, request_log.secret_fields(MappingData), sampled_endpoints=('healthz', 'get_mapping'))
 
 def upload_mapping_json(bucket_name, file_name, gbq_output_table, project_id, region,
-                        temp_location, delimiter, gbq_write_mode, overwrite=True):
+                        temp_location, delimiter, gbq_write_mode, overwrite=True, if_generation_match=None):
     # Create JSON content
     mapping = {
         "gbq_output_table": gbq_output_table,
@@ -37,20 +73,12 @@ def upload_mapping_json(bucket_name, file_name, gbq_output_table, project_id, re
         "gbq_write_mode": gbq_write_mode,
         "overwrite": overwrite
     }
-    json_content = json.dumps(mapping, indent=4)
-
-    # Upload JSON file to GCS
-    storage_client = storage.Client(project='brlcto-gbq-migration')
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(file_name)
-
-    if blob.exists() and overwrite:
-        blob.delete()
 
-    if not blob.exists() or overwrite:
-        blob.upload_from_string(json_content)
+    # Upload JSON file to GCS in one request; raises MappingConflict if the precondition fails
+    generation = write_mapping(bucket_name, file_name, mapping, overwrite, if_generation_match)
 
-    print(f"File {file_name} uploaded to bucket {bucket_name} with overwrite={overwrite}")
+    print(f"File {file_name} uploaded to bucket {bucket_name} with overwrite={overwrite}, generation {generation}")
+    return generation
 
 @app.route('/upload_mapping', methods=['POST', 'OPTIONS'])
 def upload_mapping():
@@ -71,28 +99,142 @@ def upload_mapping():
         }
 
         data = request.get_json()
-        print("Received data:", data)
+        request_log.annotate(payload=data)
 
         # Extract the gbqData dictionary from the incoming data
 
         
         try:
             mapping_data = MappingData(**data)
-            print("Validated mapping data:", mapping_data)
 
-            print(BUCKET_NAME, FILE_NAME, mapping_data.gbq_output_table, mapping_data.project_id, mapping_data.region, mapping_data.temp_location, mapping_data.delimiter, mapping_data.gbq_write_mode, mapping_data.overwrite)
-    
             # Upload the JSON file
-            upload_mapping_json(BUCKET_NAME, FILE_NAME, mapping_data.gbq_output_table, mapping_data.project_id,
-                                mapping_data.region, mapping_data.temp_location, mapping_data.delimiter,
-                                mapping_data.gbq_write_mode, mapping_data.overwrite)
-            return jsonify({"message": f"File {FILE_NAME} uploaded to bucket {BUCKET_NAME} with overwrite={mapping_data.overwrite}"}), 200, cors_headers
+            generation = upload_mapping_json(BUCKET_NAME, FILE_NAME, mapping_data.gbq_output_table,
+                                             mapping_data.project_id, mapping_data.region,
+                                             mapping_data.temp_location, mapping_data.delimiter,
+                                             mapping_data.gbq_write_mode, mapping_data.overwrite,
+                                             mapping_data.if_generation_match)
+            return jsonify({"message": f"File {FILE_NAME} uploaded to bucket {BUCKET_NAME} with overwrite={mapping_data.overwrite}",
+                            "generation": generation}), 200, cors_headers
+        except MappingConflict as e:
+            request_log.annotate(error=str(e))
+            return jsonify({"error": str(e)}), 409, cors_headers
         except ValidationError as e:
-            print("Validation error:", e)
+            request_log.annotate(error=request_log.validation_errors(e))
             return jsonify({"error": e.errors()}), 400, cors_headers
     except Exception as e:
-        print("Exception:", e)
+        request_log.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500, cors_headers
+
+def validate_mapping_items(items):
+    # Every item is checked before anything is written; returns (mapping items, per-item errors)
+    mapping_items, errors, seen = [], [], set()
+    for index, item in enumerate(items):
+        try:
+            mapping_item = MappingItem(**item)
+        except ValidationError as e:
+            errors.append({"index": index, "error": request_log.validation_errors(e)})
+            continue
+        except TypeError:
+            errors.append({"index": index, "error": "each mapping must be an object"})
+            continue
+        if not OBJECT_KEY_PATTERN.match(mapping_item.object_key):
+            errors.append({"index": index, "object_key": mapping_item.object_key,
+                           "error": "object_key must be a relative path ending in .json"})
+        elif mapping_item.object_key in seen:
+            errors.append({"index": index, "object_key": mapping_item.object_key,
+                           "error": "object_key appears more than once in the batch"})
+        seen.add(mapping_item.object_key)
+        mapping_items.append(mapping_item)
+    return mapping_items, errors
+
+def upload_mapping_item(index, mapping_item):
+    start = time.perf_counter()
+    result = {"index": index, "object_key": mapping_item.object_key}
+    try:
+        result["generation"] = upload_mapping_json(BUCKET_NAME, mapping_item.object_key, mapping_item.gbq_output_table,
+                                                   mapping_item.project_id, mapping_item.region,
+                                                   mapping_item.temp_location, mapping_item.delimiter,
+                                                   mapping_item.gbq_write_mode, mapping_item.overwrite,
+                                                   mapping_item.if_generation_match)
+        result["status"] = 200
+    except MappingConflict as e:
+        result.update(status=409, error=str(e))
+    except Exception as e:
+        result.update(status=500, error=str(e))
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+@app.route('/upload_mapping/batch', methods=['POST', 'OPTIONS'])
+def upload_mapping_batch():
+    cors_headers = CORS_HEADERS
+
+    if request.method == 'OPTIONS':
+        return ('', 204, cors_headers)
+
+    try:
+        data = request.get_json()
+        request_log.annotate(payload=data)
+
+        items = data.get('mappings') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "mappings must be a non-empty list"}), 400, cors_headers
+        if len(items) > MAX_BATCH_MAPPINGS:
+            return jsonify({"error": f"at most {MAX_BATCH_MAPPINGS} mappings per batch"}), 400, cors_headers
+
+        mapping_items, errors = validate_mapping_items(items)
+        if errors:
+            request_log.annotate(error=errors)
+            return jsonify({"error": "no mappings were written", "invalid": errors}), 400, cors_headers
+
+        # The shared pool bounds GCS writes across concurrent batches
+        start = time.perf_counter()
+        futures = [upload_executor.submit(upload_mapping_item, index, mapping_item)
+                   for index, mapping_item in enumerate(mapping_items)]
+        results = [future.result() for future in futures]
+        elapsed = round(time.perf_counter() - start, 3)
+
+        failed = [result for result in results if result["status"] != 200]
+        request_log.annotate(written=len(results) - len(failed), failed=len(failed), seconds=elapsed)
+        response = {
+            "message": f"Wrote {len(results) - len(failed)} of {len(results)} mappings to bucket {BUCKET_NAME}",
+            "seconds": elapsed,
+            "results": results,
+        }
+        # 207 Multi-Status when some items failed; each result carries its own status
+        return jsonify(response), 207 if failed else 200, cors_headers
+    except Exception as e:
+        request_log.annotate(error=str(e))
         return jsonify({"error": str(e)}), 500, cors_headers
 
+@app.route('/mapping/<path:object_key>', methods=['GET'])
+def get_mapping(object_key):
+    from google.api_core.exceptions import NotFound
+
+    if not OBJECT_KEY_PATTERN.match(object_key):
+        return jsonify({"error": "object_key must be a relative path ending in .json"}), 400, CORS_HEADERS
+    try:
+        content, generation, served = read_mapping(BUCKET_NAME, object_key)
+    except NotFound:
+        return jsonify({"error": f"Mapping {object_key} not found"}), 404, CORS_HEADERS
+    except Exception as e:
+        request_log.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500, CORS_HEADERS
+
+    # The object generation is the ETag, so a client holding the current version gets a bodyless 304
+    etag = f'"{generation}"'
+    headers = {**CORS_HEADERS, 'ETag': etag, 'Cache-Control': 'no-cache', 'X-Mapping-Generation': str(generation),
+               'X-Cache': served}
+    request_log.annotate(cache=served, generation=generation)
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return '', 304, headers
+    return content, 200, {**headers, 'Content-Type': 'application/json'}
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    warm_up()
+    return jsonify({"status": "ok", "startup": startup.profile(), "mapping_cache": mapping_cache.stats()}), 200
+
+startup.app_ready()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080, debug=True)
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Project the mapping bucket is billed to
+PROJECT_ID = 'brlcto-gbq-migration'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class MappingConflict(Exception):
+    pass
+
+
+def get_client():
+    # One client per process: it holds the credentials and the HTTP connection pool
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google.cloud import storage
+                _client = storage.Client(project=PROJECT_ID)
+    return _client
+
+
+def write_mapping(bucket_name, object_key, mapping, overwrite=True, if_generation_match=None):
+    # A single upload with a generation precondition: create-only is generation 0 (the object
+    # must not exist), a caller-supplied generation only replaces that exact version, and a
+    # plain overwrite has no precondition. Returns the generation that was written.
+    from google.api_core.exceptions import PreconditionFailed
+
+    if if_generation_match is None and not overwrite:
+        if_generation_match = 0
+
+    content = json.dumps(mapping, indent=4).encode()
+    blob = get_client().bucket(bucket_name).blob(object_key)
+    try:
+        blob.upload_from_string(content, content_type='application/json',
+                                if_generation_match=if_generation_match)
+    except PreconditionFailed:
+        if if_generation_match == 0:
+            raise MappingConflict(f"gs://{bucket_name}/{object_key} already exists and overwrite is false")
+        raise MappingConflict(f"gs://{bucket_name}/{object_key} is no longer at generation {if_generation_match}")
+    # Readers in this process see the new version without a round trip
+    cache.put(bucket_name, object_key, content, blob.generation)
+    return blob.generation
+
+
+# Read cache. Entries younger than MAPPING_FRESH_SECONDS are served as they are; older ones are
+# revalidated with a download conditional on the generation changing, which costs one request
+# with no body when the mapping is unchanged. Entries are dropped after MAPPING_CACHE_TTL
+# seconds, and least recently used ones once the cache is over its entry or byte budget.
+MAPPING_FRESH_SECONDS = float(os.environ.get('MAPPING_FRESH_SECONDS', 2))
+MAPPING_CACHE_TTL = int(os.environ.get('MAPPING_CACHE_TTL', 600))
+MAPPING_CACHE_MAX_ENTRIES = int(os.environ.get('MAPPING_CACHE_MAX_ENTRIES', 1024))
+MAPPING_CACHE_MAX_BYTES = int(os.environ.get('MAPPING_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+class _Entry:
+    def __init__(self, content, generation):
+        self.content = content
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+        self.checked_at = self.loaded_at
+
+
+class MappingCache:
+    def __init__(self, max_entries=MAPPING_CACHE_MAX_ENTRIES, max_bytes=MAPPING_CACHE_MAX_BYTES,
+                 ttl=MAPPING_CACHE_TTL, fresh_seconds=MAPPING_FRESH_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.fresh_seconds = fresh_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # (bucket, key) -> _Entry, least recently used first
+        self.bytes = 0
+        self.counts = {"hit": 0, "revalidated": 0, "miss": 0, "evicted": 0}
+
+    def get(self, bucket_name, object_key):
+        # Returns (content, generation, how it was served: hit, revalidated or miss)
+        from google.api_core.exceptions import NotFound, NotModified
+
+        key = (bucket_name, object_key)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry.loaded_at > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if now - entry.checked_at <= self.fresh_seconds:
+                    self.counts["hit"] += 1
+                    return entry.content, entry.generation, 'hit'
+
+        blob = get_client().bucket(bucket_name).blob(object_key)
+        try:
+            # Raises NotFound when the object is gone, NotModified (304) when it is unchanged
+            content = blob.download_as_bytes(
+                if_generation_not_match=entry.generation if entry is not None else None)
+        except NotModified:
+            with self.lock:
+                entry.checked_at = time.monotonic()
+                self.counts["revalidated"] += 1
+            return entry.content, entry.generation, 'revalidated'
+        except NotFound:
+            with self.lock:
+                self._remove(key)
+            raise
+
+        self.put(bucket_name, object_key, content, blob.generation)
+        with self.lock:
+            self.counts["miss"] += 1
+        return content, blob.generation, 'miss'
+
+    def put(self, bucket_name, object_key, content, generation):
+        key = (bucket_name, object_key)
+        with self.lock:
+            current = self.entries.get(key)
+            if current is not None and generation is not None and current.generation is not None \
+                    and int(current.generation) > int(generation):
+                # A newer write or read got here first
+                return
+            self._remove(key)
+            if len(content) > self.max_bytes:
+                return
+            self.entries[key] = _Entry(content, generation)
+            self.bytes += len(content)
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counts["evicted"] += 1
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, **self.counts}
+
+    def _remove(self, key):
+        # Called with the lock held
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry.content)
+
+
+cache = MappingCache()
+
+
+def read_mapping(bucket_name, object_key):
+    return cache.get(bucket_name, object_key)
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+import name_map
+
+# A table's shards are split across at most this many concurrent load jobs (more only when a
+# job would exceed MAX_URIS_PER_LOAD_JOB). BigQuery allows 1,500 load jobs per table per day,
+# and a COPY INTO of a large table writes thousands of files.
+LOAD_JOBS_PER_TABLE = int(os.environ.get('BQ_LOAD_JOBS_PER_TABLE', 4))
+# Fixed shards per load job instead of the split above; 0 leaves it to LOAD_JOBS_PER_TABLE
+SHARDS_PER_LOAD_JOB = int(os.environ.get('BQ_LOAD_SHARDS_PER_JOB', 0))
+# BigQuery accepts at most this many source URIs in one load job
+MAX_URIS_PER_LOAD_JOB = 10000
+
+WRITE_DISPOSITIONS = ('WRITE_APPEND', 'WRITE_TRUNCATE', 'WRITE_EMPTY')
+
+# Mappings used for SQL translation are read from GCS again after this many seconds
+MAPPING_TTL_SECONDS = int(os.environ.get('MAPPING_TTL_SECONDS', 60))
+
+_mappings = {}  # mapping_uri -> (read at, mapping)
+_mappings_lock = threading.Lock()
+
+
+def read_mapping(project_id, mapping_uri):
+    # mapping_uri is gs://bucket/object, e.g. the mapping.json uploaded through /upload_mapping
+    from google.cloud import storage
+
+    bucket_name, _, object_name = mapping_uri[len('gs://'):].partition('/')
+    storage_client = storage.Client(project=project_id)
+    content = storage_client.bucket(bucket_name).blob(object_name).download_as_bytes()
+    return json.loads(content)
+
+
+def cached_mapping(project_id, mapping_uri):
+    # The same dict is handed out while the mapping is unchanged, so its compiled name map and
+    # the translation templates built on it are reused
+    now = time.monotonic()
+    with _mappings_lock:
+        cached = _mappings.get(mapping_uri)
+    if cached is not None and now - cached[0] < MAPPING_TTL_SECONDS:
+        return cached[1]
+    mapping = read_mapping(project_id, mapping_uri)
+    if cached is not None and cached[1] == mapping:
+        mapping = cached[1]
+    with _mappings_lock:
+        _mappings[mapping_uri] = (now, mapping)
+    return mapping
+
+
+def resolve_target(mapping, database, schema, relation):
+    # name_map entries (see sample_sql/mapping.json) win over a single gbq_output_table;
+    # the name map is compiled once per mapping and looked up by hash. The transfer SQL quotes
+    # the request's names, so they are looked up quoted, exactly as written.
+    names = (f'"{name}"' for name in (database, schema, relation))
+    target = name_map.for_mapping(mapping).relation(*names)
+    if target is not None:
+        return ".".join(target)
+    if mapping.get("gbq_output_table"):
+        return mapping["gbq_output_table"]
+    raise ValueError(f"No BigQuery target for {database}.{schema}.{relation} in the mapping")
+
+
+def write_disposition_for(gbq_write_mode):
+    # Accepts WRITE_APPEND as well as the short forms append / truncate / empty
+    mode = (gbq_write_mode or 'WRITE_APPEND').upper()
+    if not mode.startswith('WRITE_'):
+        mode = f"WRITE_{mode}"
+    if mode not in WRITE_DISPOSITIONS:
+        raise ValueError(f"gbq_write_mode must be one of {', '.join(WRITE_DISPOSITIONS)}")
+    return mode
+
+
+def load_job_config(file_format, write_disposition, delimiter=','):
+    from google.cloud import bigquery
+
+    job_config = bigquery.LoadJobConfig(write_disposition=write_disposition)
+    if file_format.upper() == 'PARQUET':
+        # Parquet carries its own schema, so column types survive the load
+        job_config.source_format = bigquery.SourceFormat.PARQUET
+    else:
+        job_config.source_format = bigquery.SourceFormat.CSV
+        job_config.field_delimiter = delimiter
+        # Matches transfer.CSV_FOR_BIGQUERY: '"'-quoted strings, which may hold newlines, and empty NULLs
+        job_config.quote_character = '"'
+        job_config.allow_quoted_newlines = True
+        job_config.null_marker = ''
+        job_config.autodetect = True
+    return job_config
+
+
+def load_uris(project_id, table_id, uris, file_format, write_disposition, delimiter=','):
+    # Load GCS objects into a BigQuery table and wait for the job to finish
+    from google.cloud import bigquery
+
+    client = bigquery.Client(project=project_id)
+    job_config = load_job_config(file_format, write_disposition, delimiter)
+    job = client.load_table_from_uri(uris, table_id, job_config=job_config)
+    job.result()
+    print(f"Loaded {job.output_rows} rows into {table_id}.")
+    return {"job_id": job.job_id, "output_rows": job.output_rows}
+
+
+def load_shards(project_id, table_id, uris, file_format, write_disposition, delimiter=','):
+    from google.cloud import bigquery
+
+    client = bigquery.Client(project=project_id)
+    size = SHARDS_PER_LOAD_JOB or -(-len(uris) // max(1, LOAD_JOBS_PER_TABLE))
+    size = max(1, min(size, MAX_URIS_PER_LOAD_JOB))
+    chunks = [uris[i:i + size] for i in range(0, len(uris), size)]
+
+    jobs = []
+    if write_disposition != 'WRITE_APPEND':
+        # Truncate/empty must happen exactly once, before any other shard lands
+        first = client.load_table_from_uri(chunks[0], table_id,
+                                           job_config=load_job_config(file_format, write_disposition, delimiter))
+        first.result()
+        jobs.append(first)
+        chunks = chunks[1:]
+
+    append_config = load_job_config(file_format, 'WRITE_APPEND', delimiter)
+    pending = [client.load_table_from_uri(chunk, table_id, job_config=append_config) for chunk in chunks]
+    errors = []
+    for job in pending:
+        try:
+            job.result()
+        except Exception as e:
+            errors.append(f"{job.job_id}: {e}")
+    jobs.extend(pending)
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(jobs)} load jobs into {table_id} failed: {'; '.join(errors)}")
+
+    output_rows = sum(job.output_rows or 0 for job in jobs)
+    print(f"Loaded {output_rows} rows into {table_id} with {len(jobs)} load jobs.")
+    return {
+        "table_id": table_id,
+        "write_disposition": write_disposition,
+        "job_ids": [job.job_id for job in jobs],
+        "output_rows": output_rows,
+    }
@@ -1,12 +1,21 @@
+# Imported first so the startup profile covers everything below
+import startup
 import os
+from typing import List, Optional
 import certifi
-from google.cloud import storage
-import json
-import snowflake.connector as snowflake
-from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from pydantic import BaseModel, ValidationError
+import metrics
+import request_log
+from bq_load import cached_mapping
+from coalesce import coalescer, reuse_window, transfer_key
+from scheduler import scheduler
+from snowflake_pool import pool
+from sql_translate import templates as translate_templates, translate
+from transfer import (TransferError, claim_run, find_run, new_run_id, parse_file_format, release_run,
+                      run_batch_transfer, run_format_comparison, run_transfer, validate_unload_options)
+from transfer_jobs import JobQueueFull, jobs
 
 app = Flask(__name__)
 
@@ -19,6 +28,16 @@ os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
 BUCKET_NAME = "snow_function"
 FILE_NAME = "mapping.json"
 
+# Upper bound on concurrent Snowflake sessions a single batch may open
+MAX_BATCH_WORKERS = int(os.environ.get('MAX_BATCH_WORKERS', 16))
+
+# SDKs the transfer code imports on first use; loaded ahead of traffic by the gunicorn hook and /healthz
+WARM_MODULES = ['snowflake.connector', 'google.cloud.storage', 'google.cloud.bigquery',
+                'pyarrow.parquet', 'pyarrow.csv']
+
+def warm_up():
+    startup.warm(WARM_MODULES)
+
 class TransferRequest(BaseModel):
     snowflake_user: str
     snowflake_password: str
@@ -32,103 +51,317 @@ class TransferRequest(BaseModel):
     gcs_project_id: str
     gcs_folder_name: str
     gcs_file_name: str
+    # Optional sharding: target bytes per file, a PARTITION BY expression
+    # (e.g. TO_DATE("EventTime")) and a manifest listing every shard
+    max_file_size: Optional[int] = None
+    partition_by: Optional[str] = None
+    write_manifest: bool = False
+    # 'csv' (default codec GZIP) or 'parquet' (default codec SNAPPY)
+    file_format: str = 'csv'
+    compression: Optional[str] = None
+    # Delta mode: only rows whose column value is past the last exported mark
+    watermark_column: Optional[str] = None
+    # Export even if the table's fingerprint has not changed since the last run
+    force: bool = False
+    # Optional load stage: target tables come from the mapping's name_map
+    load_to_bigquery: bool = False
+    mapping_uri: Optional[str] = None
+    gbq_write_mode: Optional[str] = None
+    # 'auto' streams tables under DIRECT_MODE_MAX_BYTES without a stage; 'stage' or 'direct' force a path
+    transfer_mode: str = 'auto'
+    # 'low', 'normal' or 'high'; decides who gets the next free unload slot on a busy warehouse
+    priority: str = 'normal'
+    # Hand out the result of an identical transfer that finished this many seconds ago instead of running again
+    reuse_window_seconds: Optional[int] = None
 
-def get_formatted_datetime():
-    now = datetime.now()
-    return now.strftime("%Y%m%d_%H%M%S")
+class BatchTransferRequest(BaseModel):
+    snowflake_user: str
+    snowflake_password: str
+    snowflake_account: str
+    snowflake_database: str
+    snowflake_schema: str
+    # Tables to unload; the whole schema when omitted
+    snowflake_tables: Optional[List[str]] = None
+    snowflake_warehouse: str
+    snowflake_role: str
+    gcs_bucket_name: str
+    gcs_project_id: str
+    gcs_folder_name: str
+    # Number of concurrent Snowflake sessions running COPY INTO
+    max_workers: int = 4
+    max_file_size: Optional[int] = None
+    write_manifest: bool = False
+    file_format: str = 'csv'
+    compression: Optional[str] = None
+    force: bool = False
+    load_to_bigquery: bool = False
+    mapping_uri: Optional[str] = None
+    gbq_write_mode: Optional[str] = None
+    priority: str = 'normal'
+
+class TranslateRequest(BaseModel):
+    # Snowflake SQL, one or more statements
+    sql: str
+    # gs://bucket/object of the mapping whose name_map gives the BigQuery names
+    mapping_uri: str
+    gcs_project_id: str
+    # Current database and schema for table names with fewer than three parts
+    snowflake_database: Optional[str] = None
+    snowflake_schema: Optional[str] = None
+
+# Structured request log; payload fields the models mark as credentials are redacted.
+# Status polling, metrics and probes are the high-volume endpoints LOG_SAMPLE_RATE applies to.
+request_log.install(app, request_log.secret_fields(TransferRequest, BatchTransferRequest),
+                    sampled_endpoints=('transfer_status', 'batch_run_status', 'metrics_endpoint', 'healthz'))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization, X-Requested-With',
+    'Access-Control-Max-Age': '3600',
+}
 
 @app.route('/transfer', methods=['POST', 'OPTIONS'])
 def transfer_data():
-    cors_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Origin, Content-Type, Accept, Authorization, X-Requested-With',
-        'Access-Control-Max-Age': '3600',
-    }
+    cors_headers = CORS_HEADERS
 
     if request.method == 'OPTIONS':
         return ('', 204, cors_headers)
 
     try:
         data = request.get_json()
-        print("Received data:", data)
-        
+        request_log.annotate(payload=data)
+
         source_data = data.get('sourceData')
         if not source_data:
             return jsonify({"error": "sourceData field is missing"}), 400, cors_headers
         
         transfer_request = TransferRequest(**source_data)
-        print("Validated transfer_request:", transfer_request)
-
-        # Create Snowflake connection
-        conn = snowflake.connect(
-            user=transfer_request.snowflake_user,
-            password=transfer_request.snowflake_password,
-            account=transfer_request.snowflake_account,
-            warehouse=transfer_request.snowflake_warehouse,
-            database=transfer_request.snowflake_database,
-            schema=transfer_request.snowflake_schema,
-            role=transfer_request.snowflake_role
-        )
-
-        cur = conn.cursor()
-        print("Snowflake connection established successfully.")
-
-        # Create Snowflake stage
-        stage_name = 'CPULOADSTG'
-        storage_integration = 'gcs_int'
 
-        try:
-            # Create Storage Integration (if not already created)
-            create_integration_sql = f"""
-            CREATE OR REPLACE STORAGE INTEGRATION {storage_integration}
-            TYPE = EXTERNAL_STAGE
-            STORAGE_PROVIDER = GCS
-            ENABLED = TRUE
-            STORAGE_ALLOWED_LOCATIONS = ('gcs://{transfer_request.gcs_bucket_name}/')
-            """
-            cur.execute(create_integration_sql)
-            print(f"Storage integration '{storage_integration}' created successfully.")
-        except Exception as e:
-            print(f"Storage integration '{storage_integration}' already exists or an error occurred: {e}")
+        options_error = validate_unload_options(transfer_request)
+        if options_error:
+            return jsonify({"error": options_error}), 400, cors_headers
+
+        # Retries and double submits of the same transfer share one run instead of each starting a COPY INTO
+        key = transfer_key(transfer_request)
+        window = reuse_window(transfer_request)
+
+        # Job mode: hand the unload to the background pool and answer right away
+        if data.get('async'):
+            try:
+                job = jobs.submit('transfer', lambda job: coalescer.run(
+                    key, lambda: run_transfer(transfer_request, job.timer), window)[0], key=key)
+            except JobQueueFull as e:
+                return jsonify({"error": str(e)}), 429, cors_headers
+            request_log.annotate(job_id=job.id)
+            return jsonify({"job_id": job.id, "state": job.state, "status_url": f"/transfer/{job.id}"}), 202, cors_headers
 
         try:
-            # Create Stage
-            create_stage_sql = f"""
-            CREATE OR REPLACE STAGE {stage_name}
-            URL='gcs://{transfer_request.gcs_bucket_name}/'
-            STORAGE_INTEGRATION={storage_integration}
-            """
-            cur.execute(create_stage_sql)
-            print(f"Stage '{stage_name}' created successfully.")
-        except Exception as e:
-            print(f"An error occurred while creating the stage: {e}")
-
-        # Copy data from Snowflake to GCS
-        formatted_datetime = get_formatted_datetime()
+            result, shared = coalescer.run(key, lambda: run_transfer(transfer_request), window)
+        except TransferError as e:
+            request_log.annotate(error=str(e))
+            return jsonify({"error": str(e)}), 500, cors_headers
+        request_log.annotate(phases=result.get("phases"), mode=result.get("mode"), coalesced=shared)
+
+        response = {"message": result["message"]}
+        if shared:
+            response["coalesced"] = True
+        for field in ("mode", "gcs_uri", "unload", "manifest_uri", "watermark", "load", "skipped",
+                      "queue_wait_seconds", "phases"):
+            if field in result:
+                response[field] = result[field]
+        return jsonify(response), 200, cors_headers
+
+    except ValidationError as e:
+        request_log.annotate(error=request_log.validation_errors(e))
+        return jsonify({"error": e.errors()}), 400, cors_headers
+    except Exception as e:
+        request_log.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500, cors_headers
+
+@app.route('/transfer/batch', methods=['POST', 'OPTIONS'])
+def transfer_batch():
+    cors_headers = CORS_HEADERS
+
+    if request.method == 'OPTIONS':
+        return ('', 204, cors_headers)
+
+    try:
+        data = request.get_json()
+        request_log.annotate(payload=data)
+
+        source_data = data.get('sourceData')
+        if not source_data:
+            return jsonify({"error": "sourceData field is missing"}), 400, cors_headers
+
+        batch_request = BatchTransferRequest(**source_data)
+        if batch_request.max_workers < 1 or batch_request.max_workers > MAX_BATCH_WORKERS:
+            return jsonify({"error": f"max_workers must be between 1 and {MAX_BATCH_WORKERS}"}), 400, cors_headers
+        options_error = validate_unload_options(batch_request)
+        if options_error:
+            return jsonify({"error": options_error}), 400, cors_headers
+
+        # Batches always run as a job; per-table progress is reported on the job status
+        # and checkpointed under the run id so an interrupted batch can be resumed
+        run_id = new_run_id()
+        return submit_batch(batch_request, run_id, cors_headers)
+
+    except ValidationError as e:
+        request_log.annotate(error=request_log.validation_errors(e))
+        return jsonify({"error": e.errors()}), 400, cors_headers
+    except Exception as e:
+        request_log.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500, cors_headers
+
+def submit_batch(batch_request, run_id, cors_headers):
+    if not claim_run(run_id):
+        return jsonify({"error": f"Migration run {run_id} is already in progress"}), 409, cors_headers
+    try:
+        job = jobs.submit('batch', lambda job: run_batch_transfer(batch_request, job.progress, job.timer, run_id))
+    except JobQueueFull as e:
+        release_run(run_id)
+        return jsonify({"error": str(e)}), 429, cors_headers
+    request_log.annotate(job_id=job.id, run_id=run_id)
+    # The warehouse's unload limit caps max_workers; say so up front rather than in the timings
+    concurrent_unloads = min(batch_request.max_workers, scheduler.limit_for(batch_request.snowflake_warehouse))
+    return jsonify({"job_id": job.id, "state": job.state, "status_url": f"/transfer/{job.id}",
+                    "run_id": run_id, "run_url": f"/transfer/batch/{run_id}",
+                    "concurrent_unloads": concurrent_unloads}), 202, cors_headers
+
+@app.route('/transfer/batch/<run_id>', methods=['GET'])
+def batch_run_status(run_id):
+    # gcs_project_id, gcs_bucket_name and gcs_folder_name in the query find a run this instance has not seen
+    run = find_run(run_id, request.args.get('gcs_project_id'), request.args.get('gcs_bucket_name'),
+                   request.args.get('gcs_folder_name'))
+    if run is None:
+        return jsonify({"error": f"Migration run {run_id} not found"}), 404, CORS_HEADERS
+    return jsonify(run), 200, CORS_HEADERS
+
+@app.route('/transfer/batch/<run_id>/resume', methods=['POST', 'OPTIONS'])
+def resume_batch(run_id):
+    cors_headers = CORS_HEADERS
+
+    if request.method == 'OPTIONS':
+        return ('', 204, cors_headers)
+
+    try:
+        # The run record has every option but the password, which the caller sends again. The
+        # bucket and folder find the record in GCS when this instance has no copy of its own.
+        data = request.get_json()
+        request_log.annotate(payload=data)
+        source_data = data.get('sourceData')
+        if not source_data:
+            return jsonify({"error": "sourceData field is missing"}), 400, cors_headers
+
+        run = find_run(run_id, source_data.get('gcs_project_id'), source_data.get('gcs_bucket_name'),
+                       source_data.get('gcs_folder_name'))
+        if run is None:
+            return jsonify({"error": f"Migration run {run_id} not found"}), 404, cors_headers
+
+        batch_request = BatchTransferRequest(**{**source_data, **run["request"]})
+        return submit_batch(batch_request, run_id, cors_headers)
+
+    except ValidationError as e:
+        request_log.annotate(error=request_log.validation_errors(e))
+        return jsonify({"error": e.errors()}), 400, cors_headers
+    except Exception as e:
+        request_log.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500, cors_headers
+
+@app.route('/transfer/compare', methods=['POST', 'OPTIONS'])
+def transfer_compare():
+    cors_headers = CORS_HEADERS
+
+    if request.method == 'OPTIONS':
+        return ('', 204, cors_headers)
+
+    try:
+        data = request.get_json()
+        request_log.annotate(payload=data)
+
+        source_data = data.get('sourceData')
+        if not source_data:
+            return jsonify({"error": "sourceData field is missing"}), 400, cors_headers
+
+        transfer_request = TransferRequest(**source_data)
+
+        # Variants look like "parquet:zstd"; the codec defaults per format when omitted
+        variants = []
+        for variant in data.get('variants') or []:
+            file_format, _, compression = variant.partition(':')
+            try:
+                variants.append(parse_file_format(file_format, compression or None))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400, cors_headers
+        load_dataset = data.get('load_dataset')
 
         try:
-            copy_data_sql = f"""
-            COPY INTO @{stage_name}/{transfer_request.gcs_folder_name}/{formatted_datetime}/{transfer_request.gcs_file_name}
-            FROM "{transfer_request.snowflake_database}"."{transfer_request.snowflake_schema}"."{transfer_request.snowflake_table}"
-            FILE_FORMAT = (TYPE = 'CSV' COMPRESSION = 'GZIP')
-            OVERWRITE = TRUE
-            """
-            cur.execute(copy_data_sql)
-            print("Data copied from Snowflake to GCS successfully.")
-        except Exception as e:
-            print(f"An error occurred while copying data: {e}")
-            return jsonify({"error": f"An error occurred while copying data: {e}"}), 500, cors_headers
-
-        return jsonify({"message": "Data copied from Snowflake to GCS successfully."}), 200, cors_headers
+            job = jobs.submit('compare', lambda job: run_format_comparison(transfer_request, variants, load_dataset,
+                                                                           job.timer))
+        except JobQueueFull as e:
+            return jsonify({"error": str(e)}), 429, cors_headers
+        request_log.annotate(job_id=job.id)
+        return jsonify({"job_id": job.id, "state": job.state, "status_url": f"/transfer/{job.id}"}), 202, cors_headers
+
+    except ValidationError as e:
+        request_log.annotate(error=request_log.validation_errors(e))
+        return jsonify({"error": e.errors()}), 400, cors_headers
+    except Exception as e:
+        request_log.annotate(error=str(e))
+        return jsonify({"error": str(e)}), 500, cors_headers
+
+@app.route('/translate', methods=['POST', 'OPTIONS'])
+def translate_sql():
+    cors_headers = CORS_HEADERS
+
+    if request.method == 'OPTIONS':
+        return ('', 204, cors_headers)
+
+    try:
+        data = request.get_json()
+        # The SQL itself can run to megabytes; log its size only
+        request_log.annotate(payload={key: value for key, value in (data or {}).items() if key != 'sql'},
+                             sql_bytes=len((data or {}).get('sql') or ''))
+
+        translate_request = TranslateRequest(**data)
+        mapping = cached_mapping(translate_request.gcs_project_id, translate_request.mapping_uri)
+        result = translate(translate_request.sql, mapping, translate_request.snowflake_database,
+                           translate_request.snowflake_schema)
+
+        templates = result.get("templates", {"hit": 0, "miss": 0})
+        metrics.TRANSLATE_TEMPLATES.inc(templates["hit"], result='hit')
+        metrics.TRANSLATE_TEMPLATES.inc(templates["miss"], result='miss')
+        request_log.annotate(statements=result["statements"], templates=templates, unmapped=result["unmapped"])
+        return jsonify(result), 200, cors_headers
 
     except ValidationError as e:
-        print(f"Validation error: {e}")
+        request_log.annotate(error=request_log.validation_errors(e))
         return jsonify({"error": e.errors()}), 400, cors_headers
     except Exception as e:
-        print(f"Exception: {e}")
+        request_log.annotate(error=str(e))
         return jsonify({"error": str(e)}), 500, cors_headers
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Used as the Cloud Run startup probe, so an instance takes traffic only once it is warm
+    warm_up()
+    return jsonify({"status": "ok", "startup": startup.profile(), "snowflake_pool": pool.stats(),
+                    "warehouses": scheduler.stats(),
+                    "translate_templates": translate_templates.stats()}), 200, CORS_HEADERS
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/transfer/<job_id>', methods=['GET'])
+def transfer_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Transfer job {job_id} not found"}), 404, CORS_HEADERS
+    return jsonify(job.to_dict()), 200, CORS_HEADERS
+
+startup.app_ready()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,97 @@
+import threading
+
+# Definitions of the integration and stage as last seen or created, per account.
+# A transfer only issues DDL when its bucket is not covered by these.
+_definitions = {}
+_lock = threading.Lock()
+
+
+def _describe(cur, sql):
+    # DESCRIBE returns one row per property; missing objects raise
+    try:
+        cur.execute(sql)
+    except Exception as e:
+        print(f"{sql} failed, treating the object as missing: {e}")
+        return None
+    columns = [column[0].lower() for column in (cur.description or [])]
+    properties = {}
+    for row in cur.fetchall():
+        entry = dict(zip(columns, row))
+        properties[str(entry.get("property", "")).upper()] = entry.get("property_value")
+    return properties
+
+
+def _locations(value):
+    # STORAGE_ALLOWED_LOCATIONS / URL come back as "a,b" or '["a","b"]'
+    if not value:
+        return []
+    value = str(value).strip().strip("[]")
+    return [item.strip().strip('"').strip("'") for item in value.split(",") if item.strip()]
+
+
+def ensure_storage_integration(cur, account, integration, bucket_name):
+    location = f"gcs://{bucket_name}/"
+    key = (account, 'integration', integration.upper())
+    with _lock:
+        cached = _definitions.get(key)
+    if cached is not None and location in cached:
+        return False
+
+    current = _describe(cur, f"DESC STORAGE INTEGRATION {integration}")
+    if current is None:
+        cur.execute(f"""
+        CREATE STORAGE INTEGRATION IF NOT EXISTS {integration}
+        TYPE = EXTERNAL_STAGE
+        STORAGE_PROVIDER = GCS
+        ENABLED = TRUE
+        STORAGE_ALLOWED_LOCATIONS = ('{location}')
+        """)
+        allowed = [location]
+        print(f"Storage integration '{integration}' created successfully.")
+    else:
+        allowed = _locations(current.get("STORAGE_ALLOWED_LOCATIONS"))
+        if location not in allowed:
+            if '*' not in allowed:
+                # ALTER keeps the integration's GCS service account, so grants and
+                # transfers already using the integration keep working
+                quoted = ", ".join(f"'{item}'" for item in allowed + [location])
+                cur.execute(f"ALTER STORAGE INTEGRATION {integration} SET STORAGE_ALLOWED_LOCATIONS = ({quoted})")
+                print(f"Storage integration '{integration}' now allows {location}.")
+            allowed.append(location)
+
+    with _lock:
+        _definitions[key] = allowed
+    return True
+
+
+def ensure_stage(cur, account, database, schema, stage, integration, bucket_name):
+    # The stage is a schema-level object created in the session's current database and schema
+    location = f"gcs://{bucket_name}/"
+    key = (account, 'stage', database.upper(), schema.upper(), stage.upper())
+    wanted = (location, integration.upper())
+    with _lock:
+        if _definitions.get(key) == wanted:
+            return False
+
+    current = _describe(cur, f"DESC STAGE {stage}")
+    if current is not None:
+        urls = _locations(current.get("URL"))
+        existing = (urls[0] if urls else None, str(current.get("STORAGE_INTEGRATION") or "").upper())
+    if current is None or existing != wanted:
+        cur.execute(f"""
+        CREATE OR REPLACE STAGE {stage}
+        URL='{location}'
+        STORAGE_INTEGRATION={integration}
+        """)
+        print(f"Stage '{stage}' created successfully.")
+
+    with _lock:
+        _definitions[key] = wanted
+    return True
+
+
+def forget(account):
+    # Drop what we know about an account, e.g. after a COPY INTO failed on the stage
+    with _lock:
+        for key in [key for key in _definitions if key[0] == account]:
+            del _definitions[key]
@@ -0,0 +1,141 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+# Fraction of successful requests logged on the sampled (high-volume) endpoints; errors are always logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+# Entries waiting for the writer thread; when full, new entries are dropped rather than blocking a request
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# Field names that hold credentials, in the request models or in free-form payloads
+SECRET_MARKERS = ('password', 'secret', 'token', 'private_key', 'passphrase', 'credential')
+REDACTED = '***'
+
+
+def model_fields(model):
+    # pydantic 2 has model_fields, pydantic 1 __fields__
+    return list(getattr(model, 'model_fields', None) or model.__fields__)
+
+
+def secret_fields(*models):
+    return {name for model in models for name in model_fields(model)
+            if any(marker in name.lower() for marker in SECRET_MARKERS)}
+
+
+def redact(value, secrets):
+    if isinstance(value, dict):
+        return {key: REDACTED if key in secrets or any(marker in str(key).lower() for marker in SECRET_MARKERS)
+                else redact(item, secrets) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item, secrets) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, which Cloud Logging parses into jsonPayload; runs on the writer thread
+    def __init__(self, secrets=()):
+        super().__init__()
+        self.secrets = set(secrets)
+
+    def format(self, record):
+        entry = {
+            "severity": record.levelname,
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "message": record.getMessage(),
+        }
+        entry.update(redact(getattr(record, 'fields', None) or {}, self.secrets))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting and redaction happen on the writer thread, not here
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+logger = logging.getLogger('request_log')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+_handler = DroppingQueueHandler(_queue)
+_stream = logging.StreamHandler(sys.stdout)
+_stream.setFormatter(JsonFormatter())
+logger.addHandler(_handler)
+_listener = QueueListener(_queue, _stream)
+_listener.start()
+atexit.register(_listener.stop)
+
+
+def validation_errors(e):
+    # Locations and messages only; pydantic also echoes the offending input, which may be a secret
+    return [{"loc": list(error.get("loc", ())), "msg": error.get("msg")} for error in e.errors()]
+
+
+def annotate(**fields):
+    # Adds fields (payload, phases, job_id, error, ...) to the current request's log entry
+    g.log_fields.update(fields)
+
+
+def request_id():
+    return getattr(g, 'request_id', None)
+
+
+def install(app, secrets, sampled_endpoints=()):
+    # One structured entry per request, written when the response is ready
+    _stream.formatter.secrets.update(secrets)
+
+    @app.before_request
+    def start_request_log():
+        trace = (request.headers.get('X-Cloud-Trace-Context') or '').split('/')[0]
+        g.request_id = request.headers.get('X-Request-Id') or trace or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+        g.log_fields = {}
+
+    @app.after_request
+    def write_request_log(response):
+        if not hasattr(g, 'request_started') or request.method == 'OPTIONS':
+            return response
+        response.headers['X-Request-Id'] = g.request_id
+        if (request.endpoint in sampled_endpoints and response.status_code < 400
+                and random.random() >= LOG_SAMPLE_RATE):
+            return response
+        fields = {
+            "request_id": g.request_id,
+            "httpRequest": {
+                "requestMethod": request.method,
+                "requestUrl": request.path,
+                "status": response.status_code,
+                "latency": f"{time.perf_counter() - g.request_started:.3f}s",
+                "remoteIp": request.headers.get('X-Forwarded-For', request.remote_addr),
+            },
+            "endpoint": request.endpoint,
+        }
+        fields.update(g.log_fields)
+        if _handler.dropped:
+            fields["log_entries_dropped"] = _handler.dropped
+        level = logging.ERROR if response.status_code >= 500 else (
+            logging.WARNING if response.status_code >= 400 else logging.INFO)
+        logger.log(level, f"{request.method} {request.path} {response.status_code}", extra={"fields": fields})
+        return response
@@ -0,0 +1,134 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Unloads allowed to run at once on one warehouse; everything else waits here instead of queueing in Snowflake
+WAREHOUSE_MAX_CONCURRENT_UNLOADS = int(os.environ.get('WAREHOUSE_MAX_CONCURRENT_UNLOADS', 2))
+# Per-warehouse overrides as JSON, e.g. {"ATF_TESTING": 1, "LOAD_XL": 8}
+WAREHOUSE_LIMITS = {name.upper(): int(limit)
+                    for name, limit in json.loads(os.environ.get('WAREHOUSE_LIMITS') or '{}').items()}
+# How long an unload may wait for its warehouse before the transfer fails
+SCHEDULER_WAIT_TIMEOUT = int(os.environ.get('SCHEDULER_WAIT_TIMEOUT', 3600))
+
+# Request priorities, highest served first
+PRIORITIES = {'low': 0, 'normal': 1, 'high': 2}
+
+
+class SchedulerTimeout(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self, caller, priority, seq):
+        self.caller = caller
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+
+
+class _Warehouse:
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = {}       # caller -> unloads running
+        self.last_served = {}   # caller -> grant number of its latest slot
+        self.grants = 0
+        self.waiting = []
+
+    def next_waiter(self):
+        # Highest priority first; within a priority the caller with the fewest running unloads,
+        # then the one served least recently, so callers take turns and one team's batch cannot
+        # starve everyone else; arrival order breaks the remaining ties
+        return min(self.waiting, key=lambda w: (-w.priority, self.running.get(w.caller, 0),
+                                                self.last_served.get(w.caller, -1), w.seq))
+
+
+class WarehouseScheduler:
+    def __init__(self, default_limit=WAREHOUSE_MAX_CONCURRENT_UNLOADS, limits=None,
+                 wait_timeout=SCHEDULER_WAIT_TIMEOUT):
+        self.default_limit = default_limit
+        self.limits = WAREHOUSE_LIMITS if limits is None else limits
+        self.wait_timeout = wait_timeout
+        self.cond = threading.Condition()
+        self.warehouses = {}
+        self.seq = itertools.count()
+
+    def acquire(self, account, warehouse, caller, priority='normal'):
+        # Blocks until the warehouse has a free unload slot; pass the returned token to release()
+        key = (account, warehouse.upper())
+        label = f"{account}/{warehouse.upper()}"
+        waiter = _Waiter(caller, PRIORITIES.get(priority, PRIORITIES['normal']), next(self.seq))
+        with self.cond:
+            queue = self.warehouses.get(key)
+            if queue is None:
+                queue = self.warehouses[key] = _Warehouse(self.limit_for(warehouse))
+            queue.waiting.append(waiter)
+            metrics.UNLOADS_QUEUED.inc(warehouse=label)
+            self._grant(queue)
+            deadline = time.monotonic() + self.wait_timeout
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.waiting.remove(waiter)
+                    metrics.UNLOADS_QUEUED.dec(warehouse=label)
+                    raise SchedulerTimeout(f"Warehouse {warehouse} had no free unload slot "
+                                           f"after {self.wait_timeout}s")
+                self.cond.wait(remaining)
+            metrics.UNLOADS_QUEUED.dec(warehouse=label)
+            metrics.UNLOADS_RUNNING.inc(warehouse=label)
+        return queue, caller, label
+
+    def limit_for(self, warehouse):
+        # Unloads this service runs at once on the warehouse, whatever a batch asks for
+        return max(1, self.limits.get(warehouse.upper(), self.default_limit))
+
+    def release(self, token):
+        queue, caller, label = token
+        with self.cond:
+            queue.running[caller] -= 1
+            if not queue.running[caller]:
+                del queue.running[caller]
+            metrics.UNLOADS_RUNNING.dec(warehouse=label)
+            self._grant(queue)
+
+    def stats(self):
+        # Local queue state per warehouse, reported on /healthz
+        with self.cond:
+            return {f"{account}/{warehouse}": {"limit": queue.limit,
+                                               "running": sum(queue.running.values()),
+                                               "waiting": len(queue.waiting)}
+                    for (account, warehouse), queue in self.warehouses.items()}
+
+    def _grant(self, queue):
+        # Called with the lock held
+        granted = False
+        while queue.waiting and sum(queue.running.values()) < queue.limit:
+            waiter = queue.next_waiter()
+            queue.waiting.remove(waiter)
+            queue.running[waiter.caller] = queue.running.get(waiter.caller, 0) + 1
+            queue.grants += 1
+            queue.last_served[waiter.caller] = queue.grants
+            waiter.granted = True
+            granted = True
+        if granted:
+            self.cond.notify_all()
+
+
+scheduler = WarehouseScheduler()
+
+
+@contextmanager
+def unload_slot(transfer_request, timer):
+    # Wraps the warehouse work of one unload; the wait is recorded as the 'queue' phase
+    with timer.phase('queue'):
+        token = scheduler.acquire(transfer_request.snowflake_account, transfer_request.snowflake_warehouse,
+                                  transfer_request.snowflake_user,
+                                  getattr(transfer_request, 'priority', None) or 'normal')
+    try:
+        yield timer.phases['queue']
+    finally:
+        scheduler.release(token)
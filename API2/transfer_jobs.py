@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from transfer import PhaseTimer
+
+# Size of the background pool and how many jobs may wait for it
+TRANSFER_WORKERS = int(os.environ.get('TRANSFER_WORKERS', 4))
+MAX_PENDING_JOBS = int(os.environ.get('TRANSFER_MAX_PENDING_JOBS', 100))
+# Finished jobs are kept this long so callers can still read their result
+JOB_TTL_SECONDS = int(os.environ.get('TRANSFER_JOB_TTL_SECONDS', 24 * 3600))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class TransferJob:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timer = PhaseTimer()
+        # Per-table progress for batch jobs, updated while the job runs
+        self.progress = {}
+        self.result = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "phases": dict(self.timer.phases),
+            "progress": {table: dict(entry) for table, entry in list(self.progress.items())},
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=TRANSFER_WORKERS, max_pending=MAX_PENDING_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transfer')
+        self.max_pending = max_pending
+        self.jobs = {}
+        self.by_key = {}    # key -> job still queued or running for it
+        self.lock = threading.Lock()
+
+    def submit(self, kind, fn, key=None):
+        # fn(job) runs on the pool; its return value becomes the job result.
+        # With a key, a job already queued or running for the same key is returned instead.
+        with self.lock:
+            self._prune()
+            existing = self.by_key.get(key) if key is not None else None
+            if existing is not None and existing.state in ('queued', 'running'):
+                return existing
+            pending = sum(1 for job in self.jobs.values() if job.state in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Too many transfer jobs in progress ({pending}), try again later")
+            job = TransferJob(kind)
+            self.jobs[job.id] = job
+            if key is not None:
+                self.by_key[key] = job
+        self.executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, fn):
+        job.state = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = fn(job)
+            job.state = 'succeeded'
+        except Exception as e:
+            print(f"Transfer job {job.id} failed: {e}")
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+        for key in [key for key, job in self.by_key.items() if job.finished_at]:
+            del self.by_key[key]
+
+
+jobs = JobManager()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold-start benchmark: each run is a fresh interpreter that imports a service, answers its
+# first /healthz (which warms the SDKs) and reports how long each step took.
+#
+#   python bench/cold_start.py --runs 5
+#   python bench/cold_start.py --service mapping --record bench/cold_start_history.jsonl
+#
+# --fake swaps Snowflake, GCS and BigQuery for the in-process fakes, which measures the
+# service's own import cost without the SDKs installed.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+SERVICES = {'transfer': ROOT, 'mapping': os.path.join(ROOT, 'API')}
+
+CHILD = """
+import json, os, sys, time
+start = time.perf_counter()
+if {fake}:
+    sys.path.insert(0, {bench!r})
+    import fake_gcs, fake_snowflake
+    fake_gcs.install()
+    fake_snowflake.install()
+sys.path.insert(0, os.getcwd())
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get('/healthz')
+healthy = time.perf_counter()
+print(json.dumps({{
+    "import_seconds": imported - start,
+    "first_healthz_seconds": healthy - imported,
+    "status": response.status_code,
+    "startup": response.get_json()["startup"],
+}}))
+"""
+
+
+def import_profile(cwd, env, top):
+    # -X importtime lines look like "import time: self [us] | cumulative | imported package"
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                             cwd=cwd, env=env, capture_output=True, text=True)
+    modules = []
+    for line in process.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not line.startswith('import time:'):
+            continue
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2].strip()
+        # Each nesting level is indented by two spaces; level 1 are the modules main imports itself
+        depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+        if depth == 1:
+            modules.append((cumulative, name))
+    modules.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in modules[:top]]
+
+
+def run_once(cwd, env, fake):
+    code = CHILD.format(fake=fake, bench=BENCH)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr else 'child failed')
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["process_seconds"] = wall
+    return result
+
+
+def summarize(values):
+    return {"median": round(statistics.median(values), 3), "min": round(min(values), 3),
+            "max": round(max(values), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the Cloud Run services")
+    parser.add_argument('--service', choices=sorted(SERVICES), default='transfer')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--fake', action='store_true', help="use the in-process Snowflake/GCS fakes")
+    parser.add_argument('--top', type=int, default=10, help="slowest imports of main to list")
+    parser.add_argument('--record', help="append the summary as one JSON line to this file")
+    args = parser.parse_args()
+
+    cwd = SERVICES[args.service]
+    env = dict(os.environ)
+    env.pop('PYTHONPATH', None)
+    runs = [run_once(cwd, env, args.fake) for _ in range(args.runs)]
+
+    summary = {
+        "service": args.service,
+        "fake": args.fake,
+        "runs": args.runs,
+        "recorded_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": sys.version.split()[0],
+        "process_seconds": summarize([run["process_seconds"] for run in runs]),
+        "import_seconds": summarize([run["import_seconds"] for run in runs]),
+        "first_healthz_seconds": summarize([run["first_healthz_seconds"] for run in runs]),
+        "warm_modules": runs[-1]["startup"]["modules"],
+    }
+    summary["slowest_imports"] = import_profile(cwd, env, args.top)
+    print(json.dumps(summary, indent=4))
+
+    if args.record:
+        with open(args.record, 'a') as history:
+            history.write(json.dumps(summary) + '\n')
+
+
+if __name__ == '__main__':
+    main()
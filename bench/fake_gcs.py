@@ -0,0 +1,84 @@
+import sys
+import threading
+import types
+
+# In-memory stand-ins for google.cloud.storage and google.cloud.bigquery
+
+objects = {}
+_lock = threading.Lock()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name, **kwargs):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        with _lock:
+            objects[(self.bucket.name, self.name)] = data
+
+    def download_as_bytes(self, **kwargs):
+        with _lock:
+            data = objects[(self.bucket.name, self.name)]
+        return data.encode() if isinstance(data, str) else data
+
+    def exists(self, **kwargs):
+        with _lock:
+            return (self.bucket.name, self.name) in objects
+
+    def delete(self, **kwargs):
+        with _lock:
+            objects.pop((self.bucket.name, self.name), None)
+
+
+class FakeBucket:
+    def __init__(self, name):
+        self.name = name
+
+    def blob(self, name, **kwargs):
+        return FakeBlob(self, name, **kwargs)
+
+
+class FakeStorageClient:
+    def __init__(self, project=None, **kwargs):
+        self.project = project
+
+    def bucket(self, name):
+        return FakeBucket(name)
+
+
+class FakeLoadJob:
+    job_id = 'fake-load-job'
+    output_rows = 0
+
+    def result(self):
+        return self
+
+
+class FakeBigQueryClient:
+    def __init__(self, project=None, **kwargs):
+        self.project = project
+
+    def load_table_from_uri(self, uris, table_id, job_config=None):
+        return FakeLoadJob()
+
+
+def install():
+    storage = types.ModuleType('google.cloud.storage')
+    storage.Client = FakeStorageClient
+    bigquery = types.ModuleType('google.cloud.bigquery')
+    bigquery.Client = FakeBigQueryClient
+    bigquery.LoadJobConfig = lambda **kwargs: types.SimpleNamespace(**kwargs)
+    bigquery.SourceFormat = types.SimpleNamespace(PARQUET='PARQUET', CSV='CSV')
+
+    google = sys.modules.get('google') or types.ModuleType('google')
+    cloud = sys.modules.get('google.cloud') or types.ModuleType('google.cloud')
+    google.cloud = cloud
+    cloud.storage = storage
+    cloud.bigquery = bigquery
+    sys.modules.update({
+        'google': google,
+        'google.cloud': cloud,
+        'google.cloud.storage': storage,
+        'google.cloud.bigquery': bigquery,
+    })
@@ -0,0 +1,102 @@
+import sys
+import threading
+import time
+import types
+import uuid
+
+# In-process stand-in for snowflake.connector. Every statement sleeps for a
+# configurable time and is recorded, so the services can be load tested offline.
+
+CONNECT_SECONDS = 0.5
+STATEMENT_SECONDS = 0.2
+# COPY INTO usually dominates; it gets its own delay
+COPY_SECONDS = 1.0
+
+statements = []
+_lock = threading.Lock()
+_stats = {"active": 0, "peak": 0, "busy_seconds": 0.0, "connects": 0}
+
+
+def reset():
+    with _lock:
+        statements.clear()
+        _stats.update(active=0, peak=0, busy_seconds=0.0, connects=0)
+
+
+def stats():
+    with _lock:
+        return dict(_stats, statements=len(statements))
+
+
+def _sleep(seconds):
+    with _lock:
+        _stats["active"] += 1
+        _stats["peak"] = max(_stats["peak"], _stats["active"])
+    try:
+        time.sleep(seconds)
+    finally:
+        with _lock:
+            _stats["active"] -= 1
+            _stats["busy_seconds"] += seconds
+
+
+class FakeCursor:
+    def __init__(self):
+        self.description = None
+        self.rows = []
+        self.sfqid = None
+
+    def execute(self, sql, params=None):
+        with _lock:
+            statements.append(sql)
+        self.sfqid = uuid.uuid4().hex
+        text = ' '.join(sql.split()).upper()
+        if text.startswith('COPY INTO'):
+            _sleep(COPY_SECONDS)
+            self.description = [('rows_unloaded',), ('input_bytes',), ('output_bytes',)]
+            self.rows = [(1000, 1000000, 250000)]
+        else:
+            _sleep(STATEMENT_SECONDS)
+            # INFORMATION_SCHEMA and DESC return nothing, so every table looks unknown
+            self.description = [('status',)]
+            self.rows = [] if 'INFORMATION_SCHEMA' in text or text.startswith('DESC') else [('ok',)]
+        return self
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor()
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def connect(**kwargs):
+    with _lock:
+        _stats["connects"] += 1
+    _sleep(CONNECT_SECONDS)
+    return FakeConnection()
+
+
+def install():
+    # Make `import snowflake.connector` resolve to this module
+    connector = sys.modules[__name__]
+    package = sys.modules.get('snowflake') or types.ModuleType('snowflake')
+    package.connector = connector
+    sys.modules['snowflake'] = package
+    sys.modules['snowflake.connector'] = connector
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Load test for the Flask /transfer service and the FastAPI /start-transfer service.
+# Snowflake, GCS and BigQuery are replaced by in-process fakes, so no cloud access is needed:
+#
+#   python bench/load_test.py --clients 16 --requests 64 --copy-seconds 1
+#   python bench/load_test.py --service flask --mode job
+#
+# Each request names its own table and file, so identical-request coalescing does not
+# fold them into one transfer. --duplicates sends the same request every time instead,
+# which measures the coalescer rather than the service's concurrency.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_gcs  # noqa: E402
+import fake_snowflake  # noqa: E402
+
+SOURCE_DATA = {
+    "snowflake_user": "bench",
+    "snowflake_password": "bench",
+    "snowflake_account": "bench-account",
+    "snowflake_database": "SNOWFLAKE_TO_GBQ",
+    "snowflake_schema": "NODE",
+    "snowflake_table": "Node_with_IP",
+    "snowflake_warehouse": "ATF_TESTING",
+    "snowflake_role": "SYSADMIN",
+    "gcs_bucket_name": "bench-bucket",
+    "gcs_project_id": "bench-project",
+    "gcs_folder_name": "bench",
+    "gcs_file_name": "Node_with_IP",
+    "transfer_mode": "stage",
+}
+
+
+def source_data(index, duplicates=False):
+    if duplicates:
+        return SOURCE_DATA
+    return dict(SOURCE_DATA, snowflake_table=f"{SOURCE_DATA['snowflake_table']}_{index}",
+                gcs_file_name=f"{SOURCE_DATA['gcs_file_name']}_{index}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_flask(threads):
+    from werkzeug.serving import make_server
+    import main
+
+    port = free_port()
+    server = make_server('127.0.0.1', port, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}", server.shutdown
+
+
+def start_fastapi(threads):
+    import uvicorn
+    sys.path.insert(0, os.path.join(ROOT, 'misclleneous'))
+    import api
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+    return f"http://127.0.0.1:{port}", stop
+
+
+def post(url, payload):
+    body = json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=600) as response:
+        return response.status, json.loads(response.read() or b'{}')
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=600) as response:
+        return response.status, json.loads(response.read() or b'{}')
+
+
+def one_request(service, base_url, mode, source=SOURCE_DATA):
+    start = time.perf_counter()
+    try:
+        if service == 'fastapi':
+            payload = {key: value for key, value in source.items()
+                       if key not in ('snowflake_table', 'gcs_folder_name', 'gcs_file_name', 'transfer_mode')}
+            status, _ = post(f"{base_url}/start-transfer", payload)
+        elif mode == 'job':
+            status, body = post(f"{base_url}/transfer", {"sourceData": source, "async": True})
+            while status == 202 or body.get("state") in ('queued', 'running'):
+                time.sleep(0.05)
+                status, body = get(f"{base_url}{body.get('status_url', '/transfer/' + body['job_id'])}")
+            status = 200 if body.get("state") == 'succeeded' else 500
+        else:
+            status, _ = post(f"{base_url}/transfer", {"sourceData": source})
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return time.perf_counter() - start, status
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run(service, mode, clients, requests, duplicates=False):
+    starter = start_flask if service == 'flask' else start_fastapi
+    base_url, stop = starter(clients)
+    fake_snowflake.reset()
+    try:
+        # One warm-up request so imports and the pool do not skew the first samples
+        one_request(service, base_url, mode, source_data('warmup'))
+        fake_snowflake.reset()
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            samples = list(executor.map(lambda index: one_request(service, base_url, mode,
+                                                                  source_data(index, duplicates)),
+                                        range(requests)))
+        wall = time.perf_counter() - wall_start
+    finally:
+        stop()
+
+    latencies = [latency for latency, status in samples]
+    errors = sum(1 for _, status in samples if status != 200)
+    snowflake_stats = fake_snowflake.stats()
+    report = {
+        "service": service,
+        "mode": mode if service == 'flask' else 'sync',
+        "clients": clients,
+        "requests": requests,
+        "duplicates": duplicates,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(requests / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        # Snowflake-side concurrency: how many sessions were busy at once, on average and at peak
+        "busy_sessions_avg": round(snowflake_stats["busy_seconds"] / wall, 2),
+        "busy_sessions_peak": snowflake_stats["peak"],
+        "snowflake_connects": snowflake_stats["connects"],
+        "statements": snowflake_stats["statements"],
+    }
+    if service == 'flask' and mode == 'job':
+        import transfer_jobs
+        report["job_workers"] = transfer_jobs.TRANSFER_WORKERS
+        report["job_worker_saturation"] = round(report["busy_sessions_avg"] / transfer_jobs.TRANSFER_WORKERS, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the transfer services")
+    parser.add_argument('--service', choices=['flask', 'fastapi', 'both'], default='both')
+    parser.add_argument('--mode', choices=['sync', 'job'], default='sync',
+                        help="Flask only: hold the request open (sync) or submit a job and poll it")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=32, help="total requests per service")
+    parser.add_argument('--duplicates', action='store_true',
+                        help="send the same request every time, to measure identical-request coalescing")
+    parser.add_argument('--connect-seconds', type=float, default=fake_snowflake.CONNECT_SECONDS)
+    parser.add_argument('--statement-seconds', type=float, default=fake_snowflake.STATEMENT_SECONDS)
+    parser.add_argument('--copy-seconds', type=float, default=fake_snowflake.COPY_SECONDS)
+    args = parser.parse_args()
+
+    fake_snowflake.CONNECT_SECONDS = args.connect_seconds
+    fake_snowflake.STATEMENT_SECONDS = args.statement_seconds
+    fake_snowflake.COPY_SECONDS = args.copy_seconds
+    fake_snowflake.install()
+    fake_gcs.install()
+    os.environ.setdefault('TRANSFER_STATE_DB', os.path.join(tempfile.mkdtemp(), 'bench_state.db'))
+
+    services = ['flask', 'fastapi'] if args.service == 'both' else [args.service]
+    for service in services:
+        print(json.dumps(run(service, args.mode, args.clients, args.requests, args.duplicates), indent=4))
+
+
+if __name__ == '__main__':
+    main()
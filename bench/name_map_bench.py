@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Name-map benchmark: writes a synthetic mapping.json with --entries name_map entries (one
+# relation-level entry per table plus attribute-level entries for its columns), then times
+# reading it, compiling the indexes and looking names up.
+#
+#   python bench/name_map_bench.py --entries 100000
+#
+# --scan also times the old linear scan over the list for a sample of the lookups.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import name_map  # noqa: E402
+
+
+def synthetic_mapping(entries, columns_per_table):
+    name_map_entries, tables = [], []
+    table = 0
+    while len(name_map_entries) < entries:
+        database, schema, relation = f"DB_{table % 10}", f"SCHEMA_{table % 100}", f"Table_{table}"
+        tables.append((database, schema, relation))
+        name_map_entries.append({
+            "source": {"type": "snowflake", "database": database, "schema": schema, "relation": relation, "attribute": ""},
+            "target": {"database": "bench-project", "schema": f"dataset_{table % 100}", "relation": relation.upper(), "attribute": ""},
+        })
+        for column in range(min(columns_per_table, entries - len(name_map_entries))):
+            name_map_entries.append({
+                "source": {"type": "snowflake", "database": database, "schema": schema, "relation": relation, "attribute": f"COL_{column}"},
+                "target": {"database": "bench-project", "schema": f"dataset_{table % 100}", "relation": relation.upper(), "attribute": f"col_{column}"},
+            })
+        table += 1
+    return {"gbq_output_table": "", "name_map": name_map_entries}, tables
+
+
+def linear_scan(mapping, database, schema, relation):
+    # resolve_target before the name map was indexed
+    for entry in mapping.get("name_map") or []:
+        source, target = entry.get("source") or {}, entry.get("target") or {}
+        if source.get("attribute"):
+            continue
+        if (source.get("database"), source.get("schema"), source.get("relation")) == (database, schema, relation):
+            return f"{target['database']}.{target['schema']}.{target['relation']}"
+    return None
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled name-map resolver")
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--columns-per-table', type=int, default=9)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--scan', action='store_true', help="also time the linear scan on a sample of lookups")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mapping, tables = synthetic_mapping(args.entries, args.columns_per_table)
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(mapping, f)
+        path = f.name
+    try:
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        with open(path) as f:
+            loaded = json.load(f)
+        read_seconds = time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+    start = time.perf_counter()
+    compiled = name_map.for_mapping(loaded)
+    compile_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    name_map.for_mapping(loaded)
+    cached_seconds = time.perf_counter() - start
+
+    picks = [random.choice(tables) for _ in range(args.lookups)]
+    columns = [f"COL_{random.randrange(args.columns_per_table + 2)}" for _ in range(args.lookups)]
+    lookups = iter(range(args.lookups))
+
+    def relation():
+        i = next(lookups)
+        assert compiled.relation(*picks[i]) is not None
+
+    def relation_folded():
+        # Lower-case spelling of unquoted names resolves through the upper-case index
+        i = next(lookups)
+        database, schema, table = picks[i]
+        assert compiled.relation(database.lower(), schema.lower(), table) is not None
+
+    def attribute():
+        # Columns past --columns-per-table fall back to the relation's target
+        i = next(lookups)
+        assert compiled.attribute(*picks[i], columns[i]) is not None
+
+    def reverse():
+        i = next(lookups)
+        database, schema, table = picks[i]
+        target = compiled.relation(database, schema, table)
+        assert compiled.source_relation(*target) is not None
+
+    results = {
+        "entries": len(loaded["name_map"]),
+        "tables": len(tables),
+        "file_mb": round(size / 1e6, 1),
+        "read_seconds": round(read_seconds, 3),
+        "compile_seconds": round(compile_seconds, 3),
+        "cached_compile_us": round(cached_seconds * 1e6, 1),
+    }
+    for name, fn in (('relation', relation), ('relation_folded', relation_folded),
+                     ('attribute', attribute), ('reverse', reverse)):
+        lookups = iter(range(args.lookups))
+        elapsed = timed(fn, args.lookups)
+        results[f"{name}_us"] = round(elapsed / args.lookups * 1e6, 2)
+
+    if args.scan:
+        sample = picks[:200]
+        start = time.perf_counter()
+        for table in sample:
+            linear_scan(loaded, *table)
+        results["linear_scan_us"] = round((time.perf_counter() - start) / len(sample) * 1e6, 1)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
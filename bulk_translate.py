@@ -0,0 +1,169 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import name_map
+import sql_translate
+
+# Translates every .sql file under a directory to BigQuery across a process pool.
+#
+#   python bulk_translate.py sample_sql out/ --mapping sample_sql/mapping.json
+#
+# Results are cached on disk under a key made of the file's content hash, the mapping's hash,
+# the translator's own source and the options, so a rerun only translates files that changed
+# (or every file, once mapping.json or the translator changes). The per-file report is
+# written as JSON lines next to the output.
+
+DEFAULT_CACHE_DIR = os.environ.get('TRANSLATE_CACHE_DIR', '.translate_cache')
+# Files handed to a worker at a time; larger chunks mean less IPC for many small files
+CHUNK_SIZE = int(os.environ.get('TRANSLATE_CHUNK_SIZE', 16))
+
+_worker = {}
+
+
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def translator_hash():
+    # Changes to the translator invalidate cached results
+    digest = hashlib.sha256()
+    for module in (sql_translate, name_map):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def mapping_version(mapping):
+    return sha256(json.dumps(mapping, sort_keys=True).encode())
+
+
+def find_sql_files(input_dir, skip_dirs=()):
+    # skip_dirs keeps an output or cache directory inside input_dir from being read back
+    skip = {os.path.abspath(path) for path in skip_dirs}
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(name for name in dirs if os.path.abspath(os.path.join(root, name)) not in skip)
+        for name in sorted(files):
+            if name.lower().endswith('.sql'):
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+
+
+def write_atomic(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def same_content(path, content):
+    if not os.path.exists(path) or os.path.getsize(path) != len(content):
+        return False
+    with open(path, 'rb') as f:
+        return f.read() == content
+
+
+def init_worker(mapping, options):
+    # Runs once per worker process: the name map is compiled here, not per file
+    _worker["mapping"] = mapping
+    _worker["options"] = options
+    name_map.for_mapping(mapping)
+
+
+def translate_file(relative_path):
+    options = _worker["options"]
+    start = time.perf_counter()
+    row = {"file": relative_path}
+    try:
+        with open(os.path.join(options["input_dir"], relative_path), 'rb') as f:
+            content = f.read()
+        key = sha256(f"{sha256(content)}:{options['version']}".encode())
+        cache_path = os.path.join(options["cache_dir"], key[:2], f"{key}.json")
+        output_path = os.path.join(options["output_dir"], relative_path)
+
+        cached = None
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path) as f:
+                    cached = json.load(f)
+            except ValueError:
+                cached = None
+        if cached is not None:
+            row["status"] = "cached"
+            result = cached
+        else:
+            row["status"] = "translated"
+            result = sql_translate.translate(content.decode('utf-8'), _worker["mapping"],
+                                             options["database"], options["schema"])
+            result["translate_seconds"] = round(time.perf_counter() - start, 4)
+            # Template hits belong to this run, not to the cached result
+            row["templates"] = result.pop("templates", {"hit": 0, "miss": 0})
+            write_atomic(cache_path, json.dumps(result).encode())
+
+        translated = result["sql"].encode('utf-8')
+        if not same_content(output_path, translated):
+            write_atomic(output_path, translated)
+        row.update({name: value for name, value in result.items() if name != "sql"})
+    except Exception as e:
+        row.update(status="failed", error=f"{type(e).__name__}: {e}")
+    row["seconds"] = round(time.perf_counter() - start, 4)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate a directory of Snowflake SQL files to BigQuery")
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--mapping', default='sample_sql/mapping.json')
+    parser.add_argument('--database', help="current database for names with fewer than three parts")
+    parser.add_argument('--schema', help="current schema for names with fewer than three parts")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--report', help="per-file report, JSON lines (default OUTPUT_DIR/translate_report.jsonl)")
+    args = parser.parse_args()
+
+    with open(args.mapping) as f:
+        mapping = json.load(f)
+    options = {
+        "input_dir": args.input_dir,
+        "output_dir": args.output_dir,
+        "cache_dir": args.cache_dir,
+        "database": args.database,
+        "schema": args.schema,
+        "version": sha256(f"{mapping_version(mapping)}:{translator_hash()}:{args.database}:{args.schema}".encode()),
+    }
+    report_path = args.report or os.path.join(args.output_dir, 'translate_report.jsonl')
+
+    start = time.perf_counter()
+    files = list(find_sql_files(args.input_dir, skip_dirs=(args.output_dir, args.cache_dir)))
+    counts = {"translated": 0, "cached": 0, "failed": 0}
+    template_counts = {"hit": 0, "miss": 0}
+    unmapped = set()
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w') as report, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                initargs=(mapping, options)) as executor:
+        for row in executor.map(translate_file, files, chunksize=CHUNK_SIZE):
+            counts[row["status"]] += 1
+            unmapped.update(row.get("unmapped") or [])
+            for name, count in (row.get("templates") or {}).items():
+                template_counts[name] += count
+            report.write(json.dumps(row) + '\n')
+            if row["status"] == "failed":
+                print(f"{row['file']}: {row['error']}", file=sys.stderr)
+
+    # Statements of translated files whose template another statement in the same worker had built
+    lookups = template_counts["hit"] + template_counts["miss"]
+    summary = {"files": len(files), **counts, "unmapped_names": len(unmapped),
+               "template_hit_rate": round(template_counts["hit"] / lookups, 4) if lookups else None,
+               "seconds": round(time.perf_counter() - start, 3), "report": report_path}
+    print(json.dumps(summary, indent=2))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import threading
+import time
+
+from transfer import resolve_file_format
+
+# Seconds a finished transfer's result is handed to identical requests; 0 only joins ones in flight
+COALESCE_REUSE_SECONDS = int(os.environ.get('TRANSFER_COALESCE_REUSE_SECONDS', 0))
+# Longest reuse window a request may ask for
+MAX_REUSE_SECONDS = int(os.environ.get('TRANSFER_COALESCE_MAX_REUSE_SECONDS', 3600))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self.followers = 0
+
+
+class Coalescer:
+    # Runs one transfer per key at a time; identical requests arriving meanwhile wait for it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def run(self, key, fn, reuse_seconds=0):
+        # Returns (result, shared); shared is True when another request did the work
+        with self.lock:
+            self._prune()
+            call = self.calls.get(key)
+            if call is not None and call.done.is_set():
+                fresh = call.error is None and time.monotonic() - call.finished_at <= reuse_seconds
+                if not fresh:
+                    call = None
+            if call is None:
+                call = self.calls[key] = _Call()
+                leader = True
+            else:
+                call.followers += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                call.finished_at = time.monotonic()
+                if call.error is not None and self.calls.get(key) is call:
+                    # Failures are shared with the requests that waited, never reused later
+                    del self.calls[key]
+            call.done.set()
+            if call.followers:
+                print(f"Shared transfer result with {call.followers} identical requests.")
+        return call.result, False
+
+    def _prune(self):
+        # Called with the lock held; finished calls only matter inside the longest reuse window
+        cutoff = time.monotonic() - max(COALESCE_REUSE_SECONDS, MAX_REUSE_SECONDS)
+        for key in [key for key, call in self.calls.items()
+                    if call.done.is_set() and call.finished_at < cutoff]:
+            del self.calls[key]
+
+
+def transfer_key(transfer_request):
+    # Identical means same source, same destination and same output shape, asked for by
+    # someone holding the same credentials
+    secret = hashlib.sha256(transfer_request.snowflake_password.encode()).hexdigest()
+    return (
+        transfer_request.snowflake_account.upper(),
+        transfer_request.snowflake_user.upper(),
+        secret,
+        f"{transfer_request.snowflake_database}.{transfer_request.snowflake_schema}."
+        f"{transfer_request.snowflake_table}",
+        f"gs://{transfer_request.gcs_bucket_name}/{transfer_request.gcs_folder_name}/{transfer_request.gcs_file_name}",
+        resolve_file_format(transfer_request),
+        getattr(transfer_request, 'transfer_mode', None),
+        getattr(transfer_request, 'partition_by', None),
+        getattr(transfer_request, 'max_file_size', None),
+        getattr(transfer_request, 'write_manifest', False),
+        getattr(transfer_request, 'watermark_column', None),
+        getattr(transfer_request, 'load_to_bigquery', False),
+        getattr(transfer_request, 'mapping_uri', None),
+        getattr(transfer_request, 'gbq_write_mode', None),
+        getattr(transfer_request, 'force', False),
+    )
+
+
+def reuse_window(transfer_request):
+    # force always means fresh work; otherwise the request may ask for its own window
+    if getattr(transfer_request, 'force', False):
+        return 0
+    window = getattr(transfer_request, 'reuse_window_seconds', None)
+    if window is None:
+        return COALESCE_REUSE_SECONDS
+    return min(max(window, 0), MAX_REUSE_SECONDS)
+
+
+coalescer = Coalescer()
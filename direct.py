@@ -0,0 +1,119 @@
+import gzip
+import os
+
+# Tables at or below this many bytes skip the stage and COPY INTO entirely
+DIRECT_MODE_MAX_BYTES = int(os.environ.get('DIRECT_MODE_MAX_BYTES', 64 * 1024 * 1024))
+# Size of each chunk the GCS upload buffers before sending it
+UPLOAD_CHUNK_SIZE = int(os.environ.get('DIRECT_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+TRANSFER_MODES = ('auto', 'stage', 'direct')
+# Options that only COPY INTO can honour
+STAGE_ONLY_OPTIONS = ('partition_by', 'max_file_size', 'write_manifest')
+# Codecs the direct writer can produce
+DIRECT_CODECS = {'CSV': ('GZIP', 'NONE'), 'PARQUET': ('SNAPPY', 'ZSTD', 'NONE')}
+
+
+class CountingWriter:
+    # Wraps the upload stream so the bytes written can be reported like COPY INTO does
+    def __init__(self, sink):
+        self.sink = sink
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.sink.write(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        self.sink.flush()
+
+    @property
+    def closed(self):
+        return self.sink.closed
+
+    def close(self):
+        pass
+
+
+def direct_blockers(transfer_request, file_format):
+    # Reasons the request cannot take the direct path
+    blockers = [option for option in STAGE_ONLY_OPTIONS if getattr(transfer_request, option, None)]
+    file_type, codec = file_format
+    if codec not in DIRECT_CODECS[file_type]:
+        blockers.append(f"compression {codec}")
+    return blockers
+
+
+def choose_direct(transfer_request, file_format, table_bytes):
+    mode = getattr(transfer_request, 'transfer_mode', None) or 'auto'
+    if mode == 'direct':
+        return True
+    if mode == 'stage' or direct_blockers(transfer_request, file_format):
+        return False
+    return table_bytes is not None and table_bytes <= DIRECT_MODE_MAX_BYTES
+
+
+def object_name_for(gcs_path, file_format):
+    file_type, codec = file_format
+    if file_type == 'PARQUET':
+        extension = '.parquet'
+    else:
+        extension = '.csv.gz' if codec == 'GZIP' else '.csv'
+    # gcs_file_name often already carries the extension, e.g. data.csv.gz
+    return gcs_path if gcs_path.endswith(extension) else f"{gcs_path}{extension}"
+
+
+def stream_table(cur, transfer_request, table, gcs_path, file_format, source_filter=None, params=None):
+    # SELECT the rows and write Arrow batches straight into a GCS object; memory stays at
+    # one result chunk plus one upload chunk no matter how big the result is
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    from google.cloud import storage
+
+    file_type, codec = file_format
+    sql = (f'SELECT * FROM "{transfer_request.snowflake_database}".'
+           f'"{transfer_request.snowflake_schema}"."{table}"')
+    if source_filter:
+        sql += f" WHERE {source_filter}"
+    cur.execute(sql, params)
+
+    object_name = object_name_for(gcs_path, file_format)
+    storage_client = storage.Client(project=transfer_request.gcs_project_id)
+    blob = storage_client.bucket(transfer_request.gcs_bucket_name).blob(object_name, chunk_size=UPLOAD_CHUNK_SIZE)
+
+    rows = 0
+    with blob.open('wb', ignore_flush=True) as sink:
+        counter = CountingWriter(sink)
+        writer = None
+        if file_type == 'PARQUET':
+            for batch in cur.fetch_arrow_batches():
+                if writer is None:
+                    writer = pq.ParquetWriter(counter, batch.schema, compression=codec.lower())
+                elif batch.schema != writer.schema:
+                    # Later chunks can type an all-NULL column differently from the first one
+                    batch = batch.cast(writer.schema)
+                writer.write_table(batch)
+                rows += batch.num_rows
+        else:
+            stream = gzip.GzipFile(fileobj=counter, mode='wb') if codec == 'GZIP' else counter
+            for batch in cur.fetch_arrow_batches():
+                if writer is None:
+                    writer = pa_csv.CSVWriter(stream, batch.schema,
+                                              write_options=pa_csv.WriteOptions(include_header=False))
+                writer.write_table(batch)
+                rows += batch.num_rows
+        if writer is not None:
+            writer.close()
+        if file_type != 'PARQUET' and codec == 'GZIP':
+            stream.close()
+
+    uri = f"gs://{transfer_request.gcs_bucket_name}/{object_name}"
+    print(f"Streamed {rows} rows from Snowflake table '{table}' to {uri}.")
+    return {
+        "gcs_uri": uri,
+        "file_format": {"type": file_type, "compression": codec},
+        "copy_result": [{"rows_unloaded": rows, "input_bytes": None, "output_bytes": counter.bytes_written}],
+        "shards": [{"uri": uri, "rows": rows, "bytes": counter.bytes_written}],
+    }
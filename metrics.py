@@ -0,0 +1,146 @@
+import functools
+import threading
+
+# Prometheus text exposition for the transfer service, served on /metrics
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + (extra or [])
+        if not pairs:
+            return ''
+        quoted = ','.join(f'{name}="{value}"' for name, value in pairs)
+        return '{' + quoted + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{self._labels(key)} {value}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = sorted(buckets)
+        self.series = {}    # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        if value is None:
+            return
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        lines = []
+        for key, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{self._labels(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{self._labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{self._labels(key)} {series[-1]}")
+        return lines
+
+
+PHASE_SECONDS = Histogram(
+    'transfer_phase_seconds', 'Time spent in each transfer phase.',
+    [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600], ['phase'])
+ROWS_UNLOADED = Histogram(
+    'transfer_rows_unloaded', 'Rows written per unload.',
+    [0, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9], ['mode'])
+INPUT_BYTES = Histogram(
+    'transfer_input_bytes', 'Uncompressed bytes read by Snowflake per unload.',
+    [1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12], ['mode'])
+OUTPUT_BYTES = Histogram(
+    'transfer_output_bytes', 'Bytes written to GCS per unload.',
+    [1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12], ['mode'])
+THROUGHPUT = Histogram(
+    'transfer_throughput_mb_per_second', 'Unload throughput in MB of input (output for streamed tables) per second.',
+    [1, 5, 10, 25, 50, 100, 250, 500, 1000], ['mode'])
+IN_FLIGHT = Gauge('transfers_in_flight', 'Transfers currently running.', ['kind'])
+ERRORS = Counter('transfer_errors_total', 'Transfers that failed, by the phase that raised.', ['phase'])
+UNLOADS_QUEUED = Gauge('warehouse_unloads_queued', 'Unloads waiting for a free slot on their warehouse.', ['warehouse'])
+UNLOADS_RUNNING = Gauge('warehouse_unloads_running', 'Unloads holding a slot on their warehouse.', ['warehouse'])
+TRANSLATE_TEMPLATES = Counter('sql_translate_templates_total',
+                              'Statements translated, by whether their template came from the cache.', ['result'])
+
+REGISTRY = [PHASE_SECONDS, ROWS_UNLOADED, INPUT_BYTES, OUTPUT_BYTES, THROUGHPUT, IN_FLIGHT, ERRORS,
+            UNLOADS_QUEUED, UNLOADS_RUNNING, TRANSLATE_TEMPLATES]
+
+
+def observe_phase(phase, seconds, failed=False):
+    PHASE_SECONDS.observe(seconds, phase=phase)
+    if failed:
+        ERRORS.inc(phase=phase)
+
+
+def observe_unload(mode, totals, seconds):
+    ROWS_UNLOADED.observe(totals.get("rows_unloaded"), mode=mode)
+    INPUT_BYTES.observe(totals.get("input_bytes"), mode=mode)
+    OUTPUT_BYTES.observe(totals.get("output_bytes"), mode=mode)
+    volume = totals.get("input_bytes") or totals.get("output_bytes")
+    if volume and seconds:
+        THROUGHPUT.observe(volume / 1e6 / seconds, mode=mode)
+
+
+def in_flight(kind):
+    # Decorator keeping transfers_in_flight up to date while the function runs
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            IN_FLIGHT.inc(kind=kind)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                IN_FLIGHT.dec(kind=kind)
+        return wrapper
+    return decorate
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
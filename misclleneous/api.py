@@ -1,6 +1,7 @@
+import time
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import snowflake.connector as snowflake
+from snowflake_pool import pool
 import google.cloud.storage as storage
 
 app = FastAPI()
@@ -23,7 +24,7 @@ async def start_transfer(config: SnowflakeGCSConfig):
 
     # Create Snowflake connection
     try:
-        conn = snowflake.connect(
+        conn = pool.acquire(
             user=config.snowflake_user,
             password=config.snowflake_password,
             account=config.snowflake_account,
@@ -48,7 +49,7 @@ async def start_transfer(config: SnowflakeGCSConfig):
         cur.execute(create_integration_sql)
     except Exception as e:
         cur.close()
-        conn.close()
+        pool.release(conn)
         raise HTTPException(status_code=400, detail=f"Storage integration error: {e}")
 
     try:
@@ -61,7 +62,7 @@ async def start_transfer(config: SnowflakeGCSConfig):
         cur.execute(create_stage_sql)
     except Exception as e:
         cur.close()
-        conn.close()
+        pool.release(conn)
         raise HTTPException(status_code=400, detail=f"Stage creation error: {e}")
 
     try:
@@ -72,15 +73,38 @@ async def start_transfer(config: SnowflakeGCSConfig):
         FILE_FORMAT = (TYPE = 'CSV' COMPRESSION = 'GZIP')
         OVERWRITE = TRUE
         """
+        start = time.perf_counter()
         cur.execute(copy_data_sql)
+        elapsed = time.perf_counter() - start
+        # COPY INTO returns one row: rows_unloaded, input_bytes, output_bytes
+        columns = [column[0].lower() for column in cur.description]
+        copy_result = dict(zip(columns, cur.fetchone() or ()))
+        query_id = cur.sfqid
     except Exception as e:
         cur.close()
-        conn.close()
+        pool.release(conn)
         raise HTTPException(status_code=500, detail=f"Data copy error: {e}")
 
     cur.close()
-    conn.close()
-    return {"message": "Data copied from Snowflake to GCS successfully."}
+    pool.release(conn)
+
+    rows_unloaded = copy_result.get("rows_unloaded", 0)
+    input_bytes = copy_result.get("input_bytes", 0)
+    output_bytes = copy_result.get("output_bytes", 0)
+    if rows_unloaded:
+        message = "Data copied from Snowflake to GCS successfully."
+    else:
+        message = "No rows were unloaded; nothing was written to GCS."
+    return {
+        "message": message,
+        "rows_unloaded": rows_unloaded,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "compression_ratio": round(input_bytes / output_bytes, 3) if input_bytes and output_bytes else None,
+        "throughput_mb_per_second": round(input_bytes / 1e6 / elapsed, 3) if input_bytes and elapsed else None,
+        "query_id": query_id,
+        "elapsed_seconds": round(elapsed, 3),
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,5 +1,5 @@
 import os
-import snowflake.connector as snowflake
+from snowflake_pool import pool
 import google.generativeai as genai
 import re
 import configparser
@@ -55,7 +55,7 @@ def get_gemini_response(question, prompt, generation_config):
 
 # Function to connect to Snowflake and execute a query
 def execute_snowflake_query(query):
-    conn = snowflake.connect(
+    conn = pool.acquire(
         user=snowflake_user,
         password=snowflake_password,
         account=snowflake_account,
@@ -63,8 +63,10 @@ def execute_snowflake_query(query):
         schema=snowflake_schema,
         role=snowflake_role
     )
-    query_result = pd.read_sql_query(query, conn)
-    conn.close()
+    try:
+        query_result = pd.read_sql_query(query, conn)
+    finally:
+        pool.release(conn)
     return query_result
 
 #Function to handle natural language input and generate SQL query
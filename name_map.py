@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+
+# Compiled form of a mapping's name_map (see sample_sql/mapping.json): Snowflake
+# (database, schema, relation, attribute) <-> BigQuery (project, dataset, table, column),
+# indexed both ways so each lookup is a couple of dict probes however long the list is.
+#
+# Snowflake folds unquoted identifiers to upper case and keeps "quoted" ones as written.
+# Mapping files usually hold the stored name (Node_with_IP), so an unquoted name in the
+# mapping is indexed both as written and folded; one written as "Name" only as written.
+# A name being looked up is folded the way Snowflake would: a quoted one matches exactly, an
+# unquoted one only in upper case, so Mixed finds a MIXED entry and never a "Mixed" one.
+# BigQuery table names are case-sensitive, column names are not.
+
+# Compiled maps kept for mapping dicts read recently, so a batch compiles its mapping once
+COMPILED_CACHE_SIZE = 8
+
+
+def quoted(name):
+    return len(name) >= 2 and name[0] == name[-1] == '"'
+
+
+def unquoted(identifier):
+    # Identifier as written, without its quotes
+    name = str(identifier or '').strip()
+    return name[1:-1].replace('""', '"') if quoted(name) else name
+
+
+def snowflake_name(identifier):
+    # Form an identifier is indexed and looked up under, as Snowflake resolves it
+    name = str(identifier or '').strip()
+    return unquoted(name) if quoted(name) else name.upper()
+
+
+class NameMap:
+    def __init__(self, entries):
+        self.relations = {}     # (database, schema, relation) -> (project, dataset, table)
+        self.attributes = {}    # (database, schema, relation, attribute) -> (project, dataset, table, column)
+        # Reverse indexes give Snowflake names as written in the mapping, without quotes
+        self.tables = {}        # (project, dataset, table) -> (database, schema, relation)
+        self.columns = {}       # (project, dataset, table, column lower-cased) -> (database, schema, relation, attribute)
+        self.entries = 0
+        for entry in entries or []:
+            self.entries += 1
+            source, target = entry.get("source") or {}, entry.get("target") or {}
+            source_key = tuple(snowflake_name(source.get(part)) for part in ("database", "schema", "relation"))
+            source_names = tuple(unquoted(source.get(part)) for part in ("database", "schema", "relation"))
+            target_key = (target.get("database") or '', target.get("schema") or '', target.get("relation") or '')
+            if source.get("attribute"):
+                attribute = snowflake_name(source["attribute"])
+                column = target.get("attribute") or unquoted(source["attribute"])
+                # The first entry for a name wins, as with a scan from the top of the list
+                self.attributes.setdefault(source_names + (unquoted(source["attribute"]),), target_key + (column,))
+                self.attributes.setdefault(source_key + (attribute,), target_key + (column,))
+                self.columns.setdefault(target_key + (column.lower(),), source_names + (unquoted(source["attribute"]),))
+            else:
+                self.relations.setdefault(source_names, target_key)
+                self.relations.setdefault(source_key, target_key)
+                self.tables.setdefault(target_key, source_names)
+
+    def __len__(self):
+        return self.entries
+
+    def _probe(self, index, *names):
+        # One dict probe on the names as Snowflake resolves them
+        return index.get(tuple(snowflake_name(name) for name in names))
+
+    def relation(self, database, schema, relation):
+        # BigQuery (project, dataset, table) for a Snowflake table, or None
+        return self._probe(self.relations, database, schema, relation)
+
+    def attribute(self, database, schema, relation, attribute):
+        # BigQuery (project, dataset, table, column) for a Snowflake column. Without an
+        # attribute-level entry the column keeps its name in the relation's target table.
+        target = self._probe(self.attributes, database, schema, relation, attribute)
+        if target is not None:
+            return target
+        table = self.relation(database, schema, relation)
+        if table is None:
+            return None
+        return table + (unquoted(attribute),)
+
+    def source_relation(self, project, dataset, table):
+        # Snowflake (database, schema, relation) a BigQuery table was mapped from, or None
+        return self.tables.get((project, dataset, table))
+
+    def source_attribute(self, project, dataset, table, column):
+        source = self.columns.get((project, dataset, table, column.lower()))
+        if source is not None:
+            return source
+        relation = self.source_relation(project, dataset, table)
+        if relation is None:
+            return None
+        return relation + (column,)
+
+
+_compiled = OrderedDict()   # id(mapping) -> (mapping, NameMap)
+_lock = threading.Lock()
+
+
+def for_mapping(mapping):
+    # NameMap of a mapping dict, compiled on first use
+    key = id(mapping)
+    with _lock:
+        cached = _compiled.get(key)
+        if cached is not None and cached[0] is mapping:
+            _compiled.move_to_end(key)
+            return cached[1]
+    name_map = NameMap(mapping.get("name_map"))
+    with _lock:
+        _compiled[key] = (mapping, name_map)
+        while len(_compiled) > COMPILED_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return name_map
@@ -0,0 +1,159 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+
+# Connections kept per (account, user, role, warehouse, database, schema)
+POOL_MAX_SIZE = int(os.environ.get('SNOWFLAKE_POOL_MAX_SIZE', 8))
+# Idle connections older than this are closed
+POOL_IDLE_TIMEOUT = int(os.environ.get('SNOWFLAKE_POOL_IDLE_TIMEOUT', 600))
+# Connections idle for longer than this are checked with SELECT 1 before reuse
+POOL_HEALTH_CHECK_AFTER = int(os.environ.get('SNOWFLAKE_POOL_HEALTH_CHECK_AFTER', 60))
+# How long a caller waits for a free connection when the pool is full
+POOL_ACQUIRE_TIMEOUT = int(os.environ.get('SNOWFLAKE_POOL_ACQUIRE_TIMEOUT', 300))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER, acquire_timeout=POOL_ACQUIRE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.cond = threading.Condition()
+        self.idle = {}      # key -> [(conn, last_used)], most recently used last
+        self.open = {}      # key -> number of connections open (idle or in use)
+        self.owners = {}    # id(conn) -> key of connections handed out
+
+    @staticmethod
+    def make_key(params):
+        # The password is part of the key (hashed) so a connection is never
+        # handed to a caller that did not authenticate with the same secret
+        secret = hashlib.sha256((params.get('password') or '').encode()).hexdigest()
+        return (params.get('account'), params.get('user'), params.get('role'),
+                params.get('warehouse'), params.get('database'), params.get('schema'), secret)
+
+    def acquire(self, **params):
+        key = self.make_key(params)
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self.cond:
+                expired = self._evict_idle()
+            for stale in expired:
+                self._close_quietly(stale)
+
+            conn, last_used = None, None
+            with self.cond:
+                if self.idle.get(key):
+                    conn, last_used = self.idle[key].pop()
+                elif self.open.get(key, 0) < self.max_size:
+                    self.open[key] = self.open.get(key, 0) + 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No Snowflake connection available for {params.get('account')} "
+                                          f"after {self.acquire_timeout}s")
+                    self.cond.wait(remaining)
+                    continue
+
+            if conn is None:
+                # The connector takes seconds to import, so it loads with the first connection
+                import snowflake.connector as snowflake
+                try:
+                    conn = snowflake.connect(client_session_keep_alive=True, **params)
+                except Exception:
+                    self._forget(key)
+                    raise
+            elif time.monotonic() - last_used > self.health_check_after and not self._healthy(conn):
+                self._discard(key, conn)
+                continue
+
+            with self.cond:
+                self.owners[id(conn)] = key
+            return conn
+
+    def release(self, conn):
+        with self.cond:
+            key = self.owners.pop(id(conn), None)
+        if key is None:
+            conn.close()
+            return
+        if conn.is_closed():
+            self._forget(key)
+            return
+        with self.cond:
+            self.idle.setdefault(key, []).append((conn, time.monotonic()))
+            self.cond.notify()
+
+    def close_all(self):
+        # Logs out idle sessions; registered to run when the worker process exits
+        with self.cond:
+            idle, self.idle = self.idle, {}
+            for key, entries in idle.items():
+                self.open[key] -= len(entries)
+            self.cond.notify_all()
+        for entries in idle.values():
+            for conn, _ in entries:
+                self._close_quietly(conn)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "open": sum(self.open.values()),
+                "idle": sum(len(entries) for entries in self.idle.values()),
+                "in_use": len(self.owners),
+            }
+
+    def _healthy(self, conn):
+        try:
+            if conn.is_closed():
+                return False
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception as e:
+            print(f"Discarding unhealthy Snowflake connection: {e}")
+            return False
+
+    def _evict_idle(self):
+        # Called with the lock held; returns the connections the caller must close
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = []
+        for key, entries in self.idle.items():
+            expired = [conn for conn, last_used in entries if last_used < cutoff]
+            if expired:
+                self.idle[key] = [(conn, last_used) for conn, last_used in entries if last_used >= cutoff]
+                self.open[key] -= len(expired)
+                evicted.extend(expired)
+        if evicted:
+            self.cond.notify_all()
+        return evicted
+
+    def _discard(self, key, conn):
+        self._close_quietly(conn)
+        self._forget(key)
+
+    def _forget(self, key):
+        with self.cond:
+            self.open[key] = max(self.open.get(key, 1) - 1, 0)
+            self.cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+pool = ConnectionPool()
+atexit.register(pool.close_all)
@@ -0,0 +1,557 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+import name_map
+
+# Snowflake to BigQuery SQL rewriting. A script is tokenized by one scan of a single regex,
+# split into statements on ';', and each statement is rewritten in one left-to-right pass
+# over its tokens, so the cost is linear in the size of the script:
+#   - table names ("DB"."SCHEMA"."Table", or shorter names after FROM/JOIN/INTO/UPDATE when a
+#     default database and schema are given) go through the mapping's name_map to
+#     `project.dataset.TABLE`; names in table position with no entry are reported as unmapped
+#   - a ILIKE b becomes LOWER(a) LIKE LOWER(b), IFF becomes IF, NVL becomes IFNULL
+#   - x::type becomes CAST(x AS bigquery_type)
+#   - other "quoted" identifiers become `backticked`, '' inside strings becomes \'
+# Constructs BigQuery has no direct equivalent for are left as they are and reported as warnings.
+#
+# Statements that differ only in their literals (WHERE Region = 'EMEA' / 'APAC') share one
+# translated template: the statement's fingerprint has its literals replaced by parameters,
+# the template is kept in a bounded LRU, and a hit only binds the new literals into it.
+
+# Templates kept per process
+TEMPLATE_CACHE_SIZE = int(os.environ.get('TRANSLATE_TEMPLATE_CACHE_SIZE', 1024))
+
+TOKEN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^'\\]|\\.|'')*(?:'|\Z))
+  | (?P<dollar>\$\$.*?(?:\$\$|\Z))
+  | (?P<quoted>"(?:[^"]|"")*(?:"|\Z))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op>::|<=|>=|<>|!=|\|\||=>|[-+*/%=<>.,;:()\[\]])
+  | (?P<other>.)
+""", re.S | re.X)
+
+SKIPPED = ('ws', 'comment')
+LITERALS = ('string', 'dollar', 'number')
+# Stands in for a literal in fingerprints and templates; never part of a real token
+PARAM = '\x00'
+
+# Words that are never operands. They end the operand of a comparison (so an ILIKE
+# operand stops there) unless noted below.
+KEYWORDS = {
+    'ALL', 'ALTER', 'AND', 'ANY', 'AS', 'ASC', 'BETWEEN', 'BY', 'CASE', 'CREATE', 'CROSS', 'DELETE', 'DESC',
+    'DISTINCT', 'DROP', 'ELSE', 'END', 'ESCAPE', 'EXCEPT', 'EXISTS', 'FETCH', 'FIRST', 'FROM', 'FULL', 'GROUP',
+    'HAVING', 'IF', 'ILIKE', 'IN', 'INNER', 'INSERT', 'INTERSECT', 'INTO', 'IS', 'JOIN', 'LAST', 'LATERAL',
+    'LEFT', 'LIKE', 'LIMIT', 'MATCHED', 'MERGE', 'MINUS', 'NATURAL', 'NOT', 'NULLS', 'OFFSET', 'ON', 'OR',
+    'ORDER', 'OUTER', 'OVER', 'PARTITION', 'QUALIFY', 'RECURSIVE', 'REPLACE', 'RIGHT', 'RLIKE', 'ROWS',
+    'SELECT', 'SET', 'SOME', 'TABLE', 'THEN', 'TOP', 'TRUNCATE', 'UNION', 'UPDATE', 'USING', 'VALUES', 'VIEW',
+    'WHEN', 'WHERE', 'WINDOW', 'WITH',
+}
+# Keywords that are also functions when a '(' follows
+CALLABLE_KEYWORDS = {'IF', 'LEFT', 'REPLACE', 'RIGHT', 'TRUNCATE', 'INSERT'}
+# A table name follows these
+TABLE_KEYWORDS = {'FROM', 'JOIN', 'INTO', 'UPDATE', 'TABLE', 'USING'}
+# ...and may still follow once these are passed (FROM LATERAL ..., TABLE IF NOT EXISTS ...)
+TABLE_PREFIX_KEYWORDS = {'LATERAL', 'IF', 'NOT', 'EXISTS', 'ONLY'}
+# These end a FROM clause, after which a comma no longer introduces a table
+CLAUSE_KEYWORDS = {'WHERE', 'GROUP', 'ORDER', 'HAVING', 'QUALIFY', 'LIMIT', 'UNION', 'EXCEPT', 'MINUS',
+                   'INTERSECT', 'ON', 'SELECT', 'WINDOW', 'SET', 'VALUES'}
+# NOT in front of these belongs to the predicate (a NOT ILIKE b)
+PREDICATE_KEYWORDS = {'LIKE', 'ILIKE', 'RLIKE', 'IN', 'BETWEEN'}
+COMPARISONS = {'=', '<', '>', '<=', '>=', '<>', '!='}
+
+FUNCTION_RENAMES = {'IFF': 'IF', 'NVL': 'IFNULL'}
+
+# Snowflake type -> BigQuery type for CAST; NUMBER and DECIMAL are handled by bigquery_type
+TYPE_MAP = {
+    'INT': 'INT64', 'INTEGER': 'INT64', 'BIGINT': 'INT64', 'SMALLINT': 'INT64', 'TINYINT': 'INT64',
+    'BYTEINT': 'INT64',
+    'FLOAT': 'FLOAT64', 'FLOAT4': 'FLOAT64', 'FLOAT8': 'FLOAT64', 'DOUBLE': 'FLOAT64', 'REAL': 'FLOAT64',
+    'VARCHAR': 'STRING', 'CHAR': 'STRING', 'CHARACTER': 'STRING', 'STRING': 'STRING', 'TEXT': 'STRING',
+    'NVARCHAR': 'STRING', 'NCHAR': 'STRING',
+    'BOOLEAN': 'BOOL', 'DATE': 'DATE', 'TIME': 'TIME', 'DATETIME': 'DATETIME', 'TIMESTAMP': 'DATETIME',
+    'TIMESTAMP_NTZ': 'DATETIME', 'TIMESTAMP_LTZ': 'TIMESTAMP', 'TIMESTAMP_TZ': 'TIMESTAMP',
+    'BINARY': 'BYTES', 'VARBINARY': 'BYTES',
+    'VARIANT': 'JSON', 'OBJECT': 'JSON', 'ARRAY': 'JSON', 'GEOGRAPHY': 'GEOGRAPHY',
+}
+NUMERIC_TYPES = {'NUMBER', 'DECIMAL', 'NUMERIC'}
+
+
+def tokenize(sql):
+    return [(match.lastgroup, match.group()) for match in TOKEN.finditer(sql)]
+
+
+def split_statements(tokens):
+    # Each statement keeps its ';'; text after the last one is a statement of its own
+    statements, current = [], []
+    for token in tokens:
+        current.append(token)
+        if token == ('op', ';'):
+            statements.append(current)
+            current = []
+    if current:
+        statements.append(current)
+    return statements
+
+
+def bigquery_type(name, args):
+    # args are the numbers inside NUMBER(p, s), VARCHAR(n) and so on
+    if name in NUMERIC_TYPES:
+        precision = int(args[0]) if args else 38
+        scale = int(args[1]) if len(args) > 1 else 0
+        if scale == 0 and args and precision <= 18:
+            return 'INT64'
+        if scale <= 9 and precision - scale <= 29:
+            return 'NUMERIC'
+        return 'BIGNUMERIC'
+    return TYPE_MAP.get(name)
+
+
+def backticked(quoted):
+    return '`' + quoted[1:-1].replace('""', '"').replace('`', '\\`') + '`'
+
+
+def string_literal(kind, text):
+    if kind == 'dollar':
+        body = text[2:-2] if text.endswith('$$') and len(text) >= 4 else text[2:]
+        return "'" + body.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n') + "'"
+    if "''" in text[1:-1]:
+        # BigQuery has no '' escape
+        return "'" + text[1:-1].replace("''", "\\'") + "'"
+    return text
+
+
+def new_report():
+    # dicts keep first-seen order without duplicates; see finish_report
+    return {"rewritten": {}, "unmapped": {}, "warnings": {}}
+
+
+def finish_report(report):
+    return {"rewritten": report["rewritten"], "unmapped": list(report["unmapped"]),
+            "warnings": list(report["warnings"])}
+
+
+class _Frame:
+    # One level of parentheses or CASE ... END
+    def __init__(self, kind=None, opened=None):
+        self.kind = kind
+        self.opened = opened            # out index of the primary the '(' or CASE belongs to
+        self.operand_start = None       # out index where the current comparison operand starts
+        self.primary_start = None       # out index where the current primary (name, literal, call) starts
+        self.pending = 0                # ')' owed at the end of the current operand (ILIKE right side)
+        self.in_from = False
+
+
+class _Rewriter:
+    def __init__(self, tokens, names, report, database=None, schema=None):
+        self.tokens = tokens
+        self.names = names
+        self.report = report
+        self.database = database
+        self.schema = schema
+        self.out = []
+        self.frames = [_Frame()]
+        self.last = None                # out index of the last significant element
+        self.last_kind = None           # 'name', 'literal', 'close', 'path', 'keyword' or 'operator'
+        self.expect_table = False
+        self.prefix = None              # element owed before the next operand (LOWER( of an ILIKE)
+
+    def next_significant(self, i):
+        while i < len(self.tokens) and self.tokens[i][0] in SKIPPED:
+            i += 1
+        return i
+
+    def warn(self, message):
+        self.report["warnings"][message] = None
+
+    def emit(self, text, kind, continues=False):
+        frame = self.frames[-1]
+        if self.prefix is not None and kind not in ('keyword', 'close'):
+            if frame.operand_start is None:
+                frame.operand_start = len(self.out)
+            self.out.append(self.prefix)
+            self.prefix = None
+        index = len(self.out)
+        self.out.append(text)
+        if kind == 'keyword':
+            frame.operand_start = frame.primary_start = None
+        else:
+            if frame.operand_start is None:
+                frame.operand_start = index
+            if kind == 'operator':
+                frame.primary_start = None
+            elif not continues or frame.primary_start is None:
+                frame.primary_start = index
+        self.last, self.last_kind = index, kind
+        return index
+
+    def end_operand(self, frame=None):
+        frame = frame or self.frames[-1]
+        if self.prefix is not None:
+            # ILIKE with nothing after it
+            self.prefix = None
+            frame.pending -= 1
+        if frame.pending and self.last is not None:
+            self.out[self.last] += ')' * frame.pending
+        frame.pending = 0
+        frame.operand_start = frame.primary_start = None
+
+    def rewrite(self):
+        tokens, i = self.tokens, 0
+        while i < len(tokens):
+            kind, text = tokens[i]
+            if kind == 'ws':
+                self.out.append(text)
+            elif kind == 'comment':
+                self.out.append('--' + text[2:] if text.startswith('//') else text)
+            elif kind in ('string', 'dollar'):
+                self.expect_table = False
+                self.emit(string_literal(kind, text), 'literal')
+            elif kind in ('number', 'param'):
+                self.expect_table = False
+                self.emit(text, 'literal')
+            elif kind == 'quoted' or (kind == 'word' and not self.is_keyword(i)):
+                i = self.name(i)
+                continue
+            elif kind == 'word':
+                i = self.keyword(i)
+                continue
+            else:
+                i = self.operator(i)
+                continue
+            i += 1
+        for frame in reversed(self.frames):
+            self.end_operand(frame)
+        return ''.join(self.out)
+
+    def is_keyword(self, i):
+        upper = self.tokens[i][1].upper()
+        if upper not in KEYWORDS:
+            return False
+        if upper in CALLABLE_KEYWORDS:
+            after = i + 1
+            return not (after < len(self.tokens) and self.tokens[after] == ('op', '('))
+        return True
+
+    def name(self, i):
+        # A dotted name: table, column, alias.column or function
+        tokens = self.tokens
+        parts, j = [tokens[i]], i + 1
+        while j + 1 < len(tokens) and tokens[j] == ('op', '.') and tokens[j + 1][0] in ('word', 'quoted'):
+            parts.append(tokens[j + 1])
+            j += 2
+        after = self.next_significant(j)
+        is_call = after < len(tokens) and tokens[after] == ('op', '(')
+        continues = self.last_kind == 'path'
+
+        text = None
+        if is_call and len(parts) == 1 and parts[0][1].upper() in FUNCTION_RENAMES:
+            text = FUNCTION_RENAMES[parts[0][1].upper()]
+        elif not is_call and not continues:
+            text = self.table(parts)
+        if text is None:
+            text = '.'.join(backticked(part) if kind == 'quoted' else part for kind, part in parts)
+        self.expect_table = False
+        self.emit(text, 'name', continues=continues)
+        return j
+
+    def table(self, parts):
+        # `project.dataset.TABLE` when the name is a mapped table, else None
+        table_position = self.expect_table
+        if len(parts) > 3 or (len(parts) < 3 and not table_position):
+            return None
+        written = '.'.join(part for _, part in parts)
+        names = [self.database, self.schema][:3 - len(parts)] + [part for _, part in parts]
+        target = self.names.relation(*names) if None not in names else None
+        if target is None:
+            if table_position:
+                self.report["unmapped"][written] = None
+            return None
+        self.report["rewritten"][written] = '.'.join(target)
+        return '`' + '.'.join(target) + '`'
+
+    def keyword(self, i):
+        kind, text = self.tokens[i]
+        upper = text.upper()
+        frame = self.frames[-1]
+        after = self.next_significant(i + 1)
+        following = self.tokens[after][1].upper() if after < len(self.tokens) else ''
+
+        if upper == 'CASE':
+            self.expect_table = False
+            opened = self.emit(text, 'name')
+            self.frames.append(_Frame('case', opened))
+            return i + 1
+        if upper == 'END' and frame.kind == 'case':
+            self.end_operand()
+            self.frames.pop()
+            self.emit(text, 'close', continues=True)
+            self.frames[-1].primary_start = frame.opened
+            return i + 1
+        if upper == 'NOT' and following in PREDICATE_KEYWORDS:
+            # Part of the predicate; the left operand still ends at self.last
+            self.out.append(text)
+            return i + 1
+        if upper == 'ILIKE':
+            return self.ilike(i, following)
+
+        keep_table = self.expect_table and upper in TABLE_PREFIX_KEYWORDS
+        self.end_operand()
+        self.emit(text, 'keyword')
+        if upper == 'ESCAPE':
+            self.warn("LIKE ... ESCAPE is not supported by BigQuery")
+        if upper in CLAUSE_KEYWORDS:
+            frame.in_from = False
+        if upper == 'FROM':
+            frame.in_from = True
+        self.expect_table = upper in TABLE_KEYWORDS or keep_table
+        return i + 1
+
+    def ilike(self, i, following):
+        # a [NOT] ILIKE b -> LOWER(a) [NOT] LIKE LOWER(b); b ends where the comparison does
+        frame = self.frames[-1]
+        text = self.tokens[i][1]
+        like = 'LIKE' if text.isupper() else 'like'
+        if following in ('ANY', 'ALL', 'SOME') or frame.operand_start is None:
+            self.warn(f"{text} {following} is left as written" if following in ('ANY', 'ALL', 'SOME')
+                      else f"{text} without a left operand is left as written")
+            self.end_operand()
+            self.emit(text, 'keyword')
+            return i + 1
+        self.out[frame.operand_start] = 'LOWER(' + self.out[frame.operand_start]
+        self.out[self.last] += ')'
+        index = len(self.out)
+        self.out.append(like)
+        self.last, self.last_kind = index, 'keyword'
+        frame.primary_start = None
+        frame.pending += 1
+        self.prefix = 'LOWER('
+        return i + 1
+
+    def operator(self, i):
+        kind, text = self.tokens[i]
+        frame = self.frames[-1]
+        self.expect_table = False
+        if text == '(':
+            if self.last_kind == 'name' and frame.primary_start is not None:
+                # A call: the '(' belongs to the name before it
+                opened = frame.primary_start
+                self.emit(text, 'name', continues=True)
+            else:
+                opened = self.emit(text, 'name')
+            self.frames.append(_Frame('paren', opened))
+            return i + 1
+        if text == ')':
+            if frame.kind is not None:
+                while self.frames[-1].kind == 'case' and len(self.frames) > 2:
+                    self.end_operand()
+                    self.frames.pop()
+                inner = self.frames.pop() if len(self.frames) > 1 else _Frame()
+                self.end_operand(inner)
+                self.emit(text, 'close', continues=True)
+                if inner.opened is not None:
+                    self.frames[-1].primary_start = inner.opened
+            else:
+                self.emit(text, 'close', continues=True)
+            return i + 1
+        if text == '::':
+            return self.cast(i)
+        if text == ';':
+            for open_frame in reversed(self.frames):
+                self.end_operand(open_frame)
+            self.frames = [_Frame()]
+            self.emit(text, 'keyword')
+            return i + 1
+        if text == ',':
+            self.end_operand()
+            self.emit(text, 'keyword')
+            self.expect_table = frame.in_from
+            return i + 1
+        if text in COMPARISONS:
+            self.end_operand()
+            self.emit(text, 'keyword')
+            return i + 1
+        if text in ('.', ':'):
+            # (expr).field, col:field
+            if text == ':':
+                self.warn("Semi-structured paths (col:field) are left as written")
+            self.emit(text, 'path', continues=True)
+            return i + 1
+        self.emit(text, 'operator')
+        return i + 1
+
+    def cast(self, i):
+        # x::type -> CAST(x AS type), x being the primary just written
+        tokens, frame = self.tokens, self.frames[-1]
+        j = self.next_significant(i + 1)
+        if frame.primary_start is None or j >= len(tokens) or tokens[j][0] != 'word':
+            self.warn(":: without an operand or a type is left as written")
+            self.emit('::', 'operator')
+            return i + 1
+        name, end = tokens[j][1].upper(), j + 1
+        k = self.next_significant(end)
+        if k < len(tokens) and tokens[k][1].upper() in ('PRECISION', 'VARYING'):
+            end = k + 1
+        args = []
+        k = self.next_significant(end)
+        if k < len(tokens) and tokens[k] == ('op', '('):
+            k += 1
+            while k < len(tokens) and tokens[k] != ('op', ')'):
+                if tokens[k][0] == 'number':
+                    args.append(tokens[k][1])
+                k += 1
+            end = k + 1
+        target = bigquery_type(name, args)
+        if target is None:
+            self.warn(f"No BigQuery type for {name}; kept as written")
+            target = ''.join(text for _, text in tokens[j:end])
+        self.out[frame.primary_start] = 'CAST(' + self.out[frame.primary_start]
+        self.out[self.last] += f' AS {target})'
+        return end
+
+
+def translate_statement(tokens, names, report, database=None, schema=None):
+    return _Rewriter(tokens, names, report, database, schema).rewrite()
+
+
+def parameterize(tokens):
+    # (tokens with every literal replaced by a PARAM token, the literals in order). The
+    # arguments of a :: cast type are kept since they decide the BigQuery type.
+    template_tokens, params, state = [], [], None
+    for kind, text in tokens:
+        if kind in LITERALS and state != 'type_args':
+            template_tokens.append(('param', PARAM))
+            params.append((kind, text))
+        else:
+            template_tokens.append((kind, text))
+        if kind in SKIPPED:
+            continue
+        if text == '::':
+            state = 'type'
+        elif state == 'type':
+            state = 'type_name' if kind == 'word' else None
+        elif state == 'type_name':
+            state = 'type_args' if text == '(' else ('type_name' if text.upper() in ('PRECISION', 'VARYING') else None)
+        elif state == 'type_args' and text == ')':
+            state = None
+    return template_tokens, params
+
+
+def bind(parts, params):
+    # Template pieces around the parameters -> statement with the literals put back
+    out = [parts[0]]
+    for (kind, text), part in zip(params, parts[1:]):
+        out.append(text if kind == 'number' else string_literal(kind, text))
+        out.append(part)
+    return ''.join(out)
+
+
+class TemplateCache:
+    def __init__(self, max_entries=TEMPLATE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> (name map, template parts, report), least recently used first
+        self.counts = {"hit": 0, "miss": 0, "evicted": 0}
+
+    def get(self, key, names):
+        with self.lock:
+            entry = self.entries.get(key)
+            # The key holds id(names); the entry holds names itself, so a reused id cannot match
+            if entry is not None and entry[0] is names:
+                self.entries.move_to_end(key)
+                self.counts["hit"] += 1
+                return entry
+            self.counts["miss"] += 1
+            return None
+
+    def put(self, key, names, parts, report):
+        with self.lock:
+            self.entries[key] = (names, parts, report)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts["evicted"] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts["hit"] + self.counts["miss"]
+            return {"entries": len(self.entries), **self.counts,
+                    "hit_rate": round(self.counts["hit"] / lookups, 4) if lookups else None}
+
+
+templates = TemplateCache()
+
+
+def translate_template(tokens, names, report, database, schema, cache):
+    # Returns (statement, whether the template came from the cache). Leading whitespace is
+    # copied as it is, so statements on separate lines share a template.
+    lead = 0
+    while tokens[lead][0] == 'ws':
+        lead += 1
+    template_tokens, params = parameterize(tokens[lead:])
+    # The fingerprint: the statement as written, literals aside
+    key = (id(names), database, schema, ''.join(text for _, text in template_tokens))
+    entry = cache.get(key, names)
+    if entry is not None:
+        _, parts, statement_report = entry
+    else:
+        statement_report = new_report()
+        template = translate_statement(template_tokens, names, statement_report, database, schema)
+        parts = template.split(PARAM)
+        cache.put(key, names, parts, statement_report)
+    for name in ("rewritten", "unmapped", "warnings"):
+        report[name].update(statement_report[name])
+    return ''.join(text for _, text in tokens[:lead]) + bind(parts, params), entry is not None
+
+
+def translate(sql, mapping, database=None, schema=None, cache=templates):
+    # Returns the BigQuery script with what was rewritten, what had no mapping and any warnings.
+    # database and schema stand in for the session's current ones on names with fewer than three parts.
+    # cache=None translates every statement from scratch.
+    names = name_map.for_mapping(mapping)
+    report = new_report()
+    pieces, statements, counts = [], 0, {"hit": 0, "miss": 0}
+    if cache is not None and PARAM in sql:
+        cache = None
+    for tokens in split_statements(tokenize(sql)):
+        if not any(kind not in SKIPPED and text != ';' for kind, text in tokens):
+            pieces.append(translate_statement(tokens, names, report, database, schema))
+            continue
+        statements += 1
+        if cache is None:
+            pieces.append(translate_statement(tokens, names, report, database, schema))
+            continue
+        statement, hit = translate_template(tokens, names, report, database, schema, cache)
+        counts["hit" if hit else "miss"] += 1
+        pieces.append(statement)
+    result = {"sql": ''.join(pieces), "statements": statements, **finish_report(report)}
+    if cache is not None:
+        result["templates"] = counts
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate a Snowflake SQL file to BigQuery")
+    parser.add_argument('sql_file')
+    parser.add_argument('--mapping', default='sample_sql/mapping.json')
+    parser.add_argument('--database')
+    parser.add_argument('--schema')
+    args = parser.parse_args()
+
+    with open(args.mapping) as f:
+        mapping = json.load(f)
+    with open(args.sql_file) as f:
+        result = translate(f.read(), mapping, args.database, args.schema)
+    print(result.pop("sql"))
+    print(json.dumps(result, indent=2), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Local SQLite file holding transfer state that must survive restarts. On Cloud Run it lives on
+# the instance's in-memory filesystem, so batch run records are also copied to GCS (see
+# transfer.save_run_record) and read back from there by another or a new instance.
+STATE_DB_PATH = os.environ.get('TRANSFER_STATE_DB', 'transfer_state.db')
+
+_lock = threading.Lock()
+_initialized = set()
+
+
+def _connect():
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30)
+    with _lock:
+        if STATE_DB_PATH not in _initialized:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                source TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (source, destination, column_name)
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                source TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (source, destination)
+            )
+            """)
+            # One row per batch migration and one per table in it, so a recycled container can resume
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS migration_runs (
+                run_id TEXT PRIMARY KEY,
+                request TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS migration_tables (
+                run_id TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                state TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (run_id, table_name)
+            )
+            """)
+            conn.commit()
+            _initialized.add(STATE_DB_PATH)
+    return conn
+
+
+def get_watermark(source, destination, column_name):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT value FROM watermarks WHERE source = ? AND destination = ? AND column_name = ?",
+            (source, destination, column_name)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def set_watermark(source, destination, column_name, value):
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO watermarks (source, destination, column_name, value, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (source, destination, column_name, value, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_fingerprint(source, destination):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT fingerprint FROM fingerprints WHERE source = ? AND destination = ?",
+            (source, destination)).fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        conn.close()
+
+
+def set_fingerprint(source, destination, fingerprint):
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO fingerprints (source, destination, fingerprint, updated_at) VALUES (?, ?, ?, ?)",
+            (source, destination, json.dumps(fingerprint, sort_keys=True), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def create_run(run_id, request, timestamp, tables):
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO migration_runs (run_id, request, timestamp, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'running', ?, ?)",
+            (run_id, json.dumps(request, default=str), timestamp, now, now))
+        conn.executemany(
+            "INSERT INTO migration_tables (run_id, table_name, state, updated_at) VALUES (?, ?, 'pending', ?)",
+            [(run_id, table, now) for table in tables])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_run(run_id):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT request, timestamp, state, created_at, updated_at FROM migration_runs WHERE run_id = ?",
+            (run_id,)).fetchone()
+        if row is None:
+            return None
+        tables = {}
+        for table, state, result, error, updated_at in conn.execute(
+                "SELECT table_name, state, result, error, updated_at FROM migration_tables WHERE run_id = ?",
+                (run_id,)):
+            tables[table] = {"state": state, "result": json.loads(result) if result else None,
+                             "error": error, "updated_at": updated_at}
+        return {"run_id": run_id, "request": json.loads(row[0]), "timestamp": row[1], "state": row[2],
+                "created_at": row[3], "updated_at": row[4], "tables": tables}
+    finally:
+        conn.close()
+
+
+def set_run_state(run_id, state):
+    conn = _connect()
+    try:
+        conn.execute("UPDATE migration_runs SET state = ?, updated_at = ? WHERE run_id = ?",
+                     (state, time.time(), run_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def set_table_state(run_id, table, state, result=None, error=None):
+    # A table keeps the result of its unload until a new one replaces it, so a failed
+    # load can be retried from the shards that are already in GCS
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE migration_tables SET state = ?, result = COALESCE(?, result), error = ?, updated_at = ? "
+            "WHERE run_id = ? AND table_name = ?",
+            (state, json.dumps(result, default=str) if result is not None else None, error, time.time(),
+             run_id, table))
+        conn.execute("UPDATE migration_runs SET updated_at = ? WHERE run_id = ?", (time.time(), run_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def put_run(run):
+    # Replaces the local record of a run with one read back from elsewhere, e.g. its GCS copy
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM migration_tables WHERE run_id = ?", (run["run_id"],))
+        conn.execute(
+            "INSERT OR REPLACE INTO migration_runs (run_id, request, timestamp, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (run["run_id"], json.dumps(run["request"], default=str), run["timestamp"], run["state"],
+             run["created_at"], run["updated_at"]))
+        conn.executemany(
+            "INSERT INTO migration_tables (run_id, table_name, state, result, error, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(run["run_id"], table, entry["state"],
+              json.dumps(entry["result"], default=str) if entry.get("result") is not None else None,
+              entry.get("error"), entry["updated_at"])
+             for table, entry in run["tables"].items()])
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,86 @@
+import glob
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import name_map  # noqa: E402
+import sql_translate  # noqa: E402
+
+with open(os.path.join(ROOT, 'sample_sql', 'mapping.json')) as f:
+    MAPPING = json.load(f)
+
+# Statements that exercise each rewrite, quoting style and literal kind
+EDGE_CASES = [
+    "SELECT * FROM \"SNOWFLAKE_TO_GBQ\".\"NODE\".\"Node_with_IP\" WHERE Message ILIKE '%err%' AND Node NOT ILIKE 'x' || y;",
+    "SELECT IFF(a > 1, 'big', 'small') AS s, NVL(b, 0), c::varchar, (a+b)::NUMBER(10,2), d::timestamp_ntz::date FROM node_with_ip t",
+    "select upper(name) ilike lower('A%') as f, CASE WHEN x ILIKE 'a' THEN 1 ELSE 2 END::int from t1, \"NODE\".Node_with_IP",
+    "SELECT 'it''s', $$a'b$$ // trailing\n FROM x; SELECT 1; ",
+    "SELECT a FROM t WHERE a ILIKE ANY ('a%','b%') AND v:field::string = 'x'",
+    "select f(x) ilike 'a' escape '!' from \"snowflake_to_gbq\".node.node_with_ip",
+    "SELECT LEFT(a, 2) ILIKE 'ab' FROM s.t WHERE (a ILIKE 'q') OR col::double precision > 1.5e3",
+    # Same shape, literals that change the translated type
+    "SELECT x::NUMBER(10,2), y::NUMBER(5), 'a''b', $$q$$, 3 FROM t WHERE a ILIKE 'z' LIMIT 5",
+    "SELECT x::NUMBER(30,2), y::NUMBER(25), 'c', $$r'$$, 4 FROM t WHERE a ILIKE 'w' LIMIT 7",
+    # The template placeholder itself; translated without the cache
+    "SELECT 'a\x00b', c::int FROM t",
+]
+
+SAMPLES = []
+for path in sorted(glob.glob(os.path.join(ROOT, 'sample_sql', '*.sql'))):
+    with open(path) as f:
+        SAMPLES.append(f.read())
+
+
+@pytest.mark.parametrize('database', [None, 'SNOWFLAKE_TO_GBQ'])
+@pytest.mark.parametrize('sql', EDGE_CASES + SAMPLES)
+def test_cached_translation_matches_fresh(sql, database):
+    fresh = sql_translate.translate(sql, MAPPING, database, 'NODE', cache=None)
+    first = sql_translate.translate(sql, MAPPING, database, 'NODE')
+    second = sql_translate.translate(sql, MAPPING, database, 'NODE')
+    assert first["sql"] == second["sql"] == fresh["sql"]
+    first.pop("templates", None)
+    if second.pop("templates", None) is not None:
+        assert fresh == first == second
+
+
+def test_placeholder_in_sql_skips_the_cache():
+    result = sql_translate.translate("SELECT 'a\x00b' FROM t", MAPPING)
+    assert "templates" not in result
+    assert result["sql"] == "SELECT 'a\x00b' FROM t"
+
+
+def test_mapped_table_is_backticked():
+    result = sql_translate.translate('SELECT * FROM "SNOWFLAKE_TO_GBQ"."NODE"."Node_with_IP"', MAPPING)
+    assert result["sql"] == "SELECT * FROM `brlcto-gbq-migration.GBQ_migration.NODE_WITH_IP`"
+
+
+def test_unquoted_names_match_regardless_of_case():
+    names = name_map.for_mapping(MAPPING)
+    assert names.relation('snowflake_to_gbq', 'node', 'NODE_WITH_IP') == \
+        ('brlcto-gbq-migration', 'GBQ_migration', 'NODE_WITH_IP')
+
+
+def test_quoted_names_match_only_as_written():
+    names = name_map.NameMap([{"source": {"database": "D", "schema": "S", "relation": '"Mixed"'},
+                               "target": {"database": "p", "schema": "d", "relation": "M"}}])
+    assert names.relation('D', 'S', '"Mixed"') == ('p', 'd', 'M')
+    assert names.relation('D', 'S', 'Mixed') is None
+    assert names.relation('D', 'S', '"MIXED"') is None
+    assert names.relation('D', 'S', 'mixed') is None
+
+
+def test_unquoted_lookup_folds_before_matching():
+    names = name_map.NameMap([
+        {"source": {"database": "D", "schema": "S", "relation": '"Mixed"'},
+         "target": {"database": "p", "schema": "d", "relation": "A"}},
+        {"source": {"database": "D", "schema": "S", "relation": "MIXED"},
+         "target": {"database": "p", "schema": "d", "relation": "B"}},
+    ])
+    assert names.relation('D', 'S', 'Mixed') == ('p', 'd', 'B')
+    assert names.relation('d', 's', 'mixed') == ('p', 'd', 'B')
+    assert names.relation('"D"', '"S"', '"Mixed"') == ('p', 'd', 'A')
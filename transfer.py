@@ -0,0 +1,794 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+from bq_load import load_shards, load_uris, read_mapping, resolve_target, write_disposition_for
+from direct import TRANSFER_MODES, choose_direct, direct_blockers, stream_table
+from provisioning import ensure_stage, ensure_storage_integration, forget as forget_provisioning
+from scheduler import PRIORITIES, scheduler, unload_slot
+from snowflake_pool import pool
+from state_store import (create_run, get_fingerprint, get_run, get_watermark, put_run, set_fingerprint,
+                         set_run_state, set_table_state, set_watermark)
+
+# Snowflake objects used to unload into GCS. Each bucket gets its own stage, so a stage is never
+# re-pointed at another bucket while a transfer elsewhere still relies on its old URL.
+STAGE_PREFIX = 'CPULOADSTG'
+STORAGE_INTEGRATION = 'gcs_int'
+
+# mapping.json written by the mapping service, used when a request names no other
+DEFAULT_MAPPING_URI = os.environ.get('MAPPING_URI', 'gs://snow_function/mapping.json')
+
+# Sharded unloads list their files in this object next to the data
+MANIFEST_NAME = 'manifest.json'
+# Largest MAX_FILE_SIZE Snowflake accepts for a GCS stage (5 GB)
+MAX_FILE_SIZE_LIMIT = 5 * 1024 ** 3
+
+# Unload formats and the codecs Snowflake accepts for them, default codec first
+FILE_FORMATS = {
+    'CSV': ['GZIP', 'ZSTD', 'BZ2', 'BROTLI', 'DEFLATE', 'RAW_DEFLATE', 'NONE'],
+    'PARQUET': ['SNAPPY', 'ZSTD', 'LZO', 'NONE'],
+}
+# Watermark columns are spliced into SQL, so only plain or quoted identifiers are accepted
+WATERMARK_COLUMN_PATTERN = re.compile(r'^(?:[A-Za-z_][A-Za-z0-9_$]*|"[^"]+")$')
+# Variants unloaded by the format comparison unless the caller picks others
+COMPARE_FORMATS = [('CSV', 'GZIP'), ('PARQUET', 'SNAPPY'), ('PARQUET', 'ZSTD')]
+# CSV unloaded for a BigQuery load: quoted strings and empty NULLs, as direct mode writes and
+# BigQuery's CSV defaults read. Snowflake's own defaults (no quoting, backslash escapes, \N)
+# split values holding a comma and fail typed columns on NULL.
+CSV_FOR_BIGQUERY = "FIELD_OPTIONALLY_ENCLOSED_BY = '\"' NULL_IF = () EMPTY_FIELD_AS_NULL = TRUE"
+# Request fields never written to the migration run record
+SECRET_FIELDS = ('snowflake_password',)
+
+# Migration runs being worked on by this process
+_active_runs = set()
+_active_runs_lock = threading.Lock()
+# Held while a run record is read and uploaded, so an older snapshot never lands after a newer one
+_run_record_lock = threading.Lock()
+
+
+class TransferError(Exception):
+    pass
+
+
+class PhaseTimer:
+    # Records the wall-clock seconds spent in each named phase of a transfer
+    def __init__(self, phases=None):
+        self.phases = phases if phases is not None else {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = round(elapsed, 3)
+            metrics.observe_phase(name, elapsed, failed)
+
+
+def mapping_uri_for(transfer_request):
+    return getattr(transfer_request, 'mapping_uri', None) or DEFAULT_MAPPING_URI
+
+
+def get_formatted_datetime():
+    now = datetime.now()
+    return now.strftime("%Y%m%d_%H%M%S")
+
+
+def fetch_result(cur):
+    # Turn the rows returned by the last statement into a list of dicts keyed by column name
+    columns = [column[0].lower() for column in (cur.description or [])]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def connect(transfer_request):
+    # Sessions come from the process-wide pool; hand them back with pool.release
+    return pool.acquire(
+        user=transfer_request.snowflake_user,
+        password=transfer_request.snowflake_password,
+        account=transfer_request.snowflake_account,
+        warehouse=transfer_request.snowflake_warehouse,
+        database=transfer_request.snowflake_database,
+        schema=transfer_request.snowflake_schema,
+        role=transfer_request.snowflake_role
+    )
+
+
+def stage_name(bucket_name):
+    # CPULOADSTG_<bucket>_<hash>; the hash keeps buckets that differ only in '-', '.' and '_' apart
+    readable = re.sub(r'[^A-Z0-9]', '_', bucket_name.upper())
+    return f"{STAGE_PREFIX}_{readable}_{hashlib.sha1(bucket_name.encode()).hexdigest()[:8].upper()}"
+
+
+def provision_stage(cur, transfer_request, timer):
+    # Integration and stage DDL only runs when the bucket is not already set up
+    with timer.phase('integration'):
+        try:
+            ensure_storage_integration(cur, transfer_request.snowflake_account, STORAGE_INTEGRATION,
+                                       transfer_request.gcs_bucket_name)
+        except Exception as e:
+            print(f"Storage integration '{STORAGE_INTEGRATION}' already exists or an error occurred: {e}")
+
+    with timer.phase('stage'):
+        try:
+            ensure_stage(cur, transfer_request.snowflake_account, transfer_request.snowflake_database,
+                         transfer_request.snowflake_schema, stage_name(transfer_request.gcs_bucket_name),
+                         STORAGE_INTEGRATION, transfer_request.gcs_bucket_name)
+        except Exception as e:
+            print(f"An error occurred while creating the stage: {e}")
+
+
+def parse_file_format(file_format, compression=None):
+    # Returns the (type, codec) pair an unload writes, e.g. ('PARQUET', 'SNAPPY')
+    file_type = (file_format or 'csv').upper()
+    codecs = FILE_FORMATS.get(file_type)
+    if codecs is None:
+        raise ValueError(f"file_format must be one of {', '.join(name.lower() for name in FILE_FORMATS)}")
+    codec = (compression or codecs[0]).upper()
+    if codec not in codecs:
+        raise ValueError(f"compression for {file_type.lower()} must be one of {', '.join(codecs)}")
+    return file_type, codec
+
+
+def resolve_file_format(transfer_request):
+    return parse_file_format(getattr(transfer_request, 'file_format', None),
+                             getattr(transfer_request, 'compression', None))
+
+
+def validate_unload_options(transfer_request):
+    max_file_size = getattr(transfer_request, 'max_file_size', None)
+    if max_file_size is not None and not 0 < max_file_size <= MAX_FILE_SIZE_LIMIT:
+        return f"max_file_size must be between 1 and {MAX_FILE_SIZE_LIMIT} bytes"
+    try:
+        resolve_file_format(transfer_request)
+    except ValueError as e:
+        return str(e)
+    if getattr(transfer_request, 'load_to_bigquery', False):
+        try:
+            write_disposition_for(getattr(transfer_request, 'gbq_write_mode', None))
+        except ValueError as e:
+            return str(e)
+    mode = getattr(transfer_request, 'transfer_mode', None) or 'auto'
+    if mode not in TRANSFER_MODES:
+        return f"transfer_mode must be one of {', '.join(TRANSFER_MODES)}"
+    if mode == 'direct':
+        blockers = direct_blockers(transfer_request, resolve_file_format(transfer_request))
+        if blockers:
+            return f"transfer_mode 'direct' does not support {', '.join(blockers)}"
+    priority = getattr(transfer_request, 'priority', None)
+    if priority is not None and priority not in PRIORITIES:
+        return f"priority must be one of {', '.join(PRIORITIES)}"
+    watermark_column = getattr(transfer_request, 'watermark_column', None)
+    if watermark_column and not WATERMARK_COLUMN_PATTERN.match(watermark_column):
+        return "watermark_column must be a column name, e.g. EventTime or \"EventTime\""
+    return None
+
+
+def copy_totals(copy_result):
+    # COPY INTO returns one summary row, or one row per file with DETAILED_OUTPUT
+    if copy_result and "file_name" in copy_result[0]:
+        return {
+            "rows_unloaded": sum(row.get("row_count") or 0 for row in copy_result),
+            "input_bytes": None,
+            "output_bytes": sum(row.get("file_size") or 0 for row in copy_result),
+        }
+    row = copy_result[0] if copy_result else {}
+    return {
+        "rows_unloaded": row.get("rows_unloaded", 0),
+        "input_bytes": row.get("input_bytes", 0),
+        "output_bytes": row.get("output_bytes", 0),
+    }
+
+
+def unload_stats(copy_result, query_id, elapsed):
+    # What Snowflake reported for the unload plus the ratios used to size warehouses
+    stats = copy_totals(copy_result)
+    input_bytes, output_bytes = stats["input_bytes"], stats["output_bytes"]
+    volume = input_bytes or output_bytes
+    stats.update({
+        "compression_ratio": round(input_bytes / output_bytes, 3) if input_bytes and output_bytes else None,
+        "throughput_mb_per_second": round(volume / 1e6 / elapsed, 3) if volume and elapsed else None,
+        "query_id": query_id,
+        "elapsed_seconds": round(elapsed, 3),
+    })
+    return stats
+
+
+def build_copy_sql(transfer_request, table, gcs_path, file_format=None, source_filter=None, for_bigquery=None):
+    file_type, codec = file_format or resolve_file_format(transfer_request)
+    if for_bigquery is None:
+        for_bigquery = getattr(transfer_request, 'load_to_bigquery', False)
+    partition_by = getattr(transfer_request, 'partition_by', None)
+    max_file_size = getattr(transfer_request, 'max_file_size', None)
+    # The manifest and the BigQuery load both need the list of written files
+    detailed_output = (getattr(transfer_request, 'write_manifest', False)
+                       or getattr(transfer_request, 'load_to_bigquery', False))
+
+    copy_options = []
+    # Snowflake rejects OVERWRITE together with PARTITION BY
+    if not partition_by:
+        copy_options.append("OVERWRITE = TRUE")
+    if max_file_size:
+        copy_options.append(f"MAX_FILE_SIZE = {int(max_file_size)}")
+    if detailed_output:
+        # One result row per written file instead of a single summary row
+        copy_options.append("DETAILED_OUTPUT = TRUE")
+    if file_type == 'PARQUET':
+        # Keep the real column names in the Parquet schema instead of _COL_n
+        copy_options.append("HEADER = TRUE")
+
+    format_options = f"TYPE = '{file_type}' COMPRESSION = '{codec}'"
+    if file_type == 'CSV' and for_bigquery:
+        format_options = f"{format_options} {CSV_FOR_BIGQUERY}"
+
+    partition_clause = f"PARTITION BY ({partition_by})" if partition_by else ""
+    source = f'"{transfer_request.snowflake_database}"."{transfer_request.snowflake_schema}"."{table}"'
+    if source_filter:
+        # The filter carries bind parameters, so literal % signs elsewhere must be escaped
+        source = f"(SELECT * FROM {source} WHERE {source_filter})"
+        partition_clause = partition_clause.replace('%', '%%')
+    return f"""
+    COPY INTO @{stage_name(transfer_request.gcs_bucket_name)}/{gcs_path}
+    FROM {source}
+    {partition_clause}
+    FILE_FORMAT = ({format_options})
+    {' '.join(copy_options)}
+    """
+
+
+def list_shards(transfer_request, gcs_path, copy_result):
+    # Shards are listed relative to the bucket so loaders do not need to list the prefix
+    bucket_name = transfer_request.gcs_bucket_name
+    folder = gcs_path.rsplit('/', 1)[0]
+    shards = []
+    for row in copy_result:
+        if "file_name" not in row:
+            continue
+        file_name = row.get("file_name") or ""
+        object_name = file_name if file_name.startswith(folder + '/') else f"{folder}/{file_name}"
+        shards.append({
+            "uri": f"gs://{bucket_name}/{object_name}",
+            "rows": row.get("row_count"),
+            "bytes": row.get("file_size"),
+        })
+    return shards
+
+
+def write_manifest(transfer_request, table, gcs_path, shards, file_format):
+    bucket_name = transfer_request.gcs_bucket_name
+    folder = gcs_path.rsplit('/', 1)[0]
+
+    manifest = {
+        "source": f"{transfer_request.snowflake_database}.{transfer_request.snowflake_schema}.{table}",
+        "gcs_prefix": f"gs://{bucket_name}/{folder}/",
+        "created_at": datetime.now().isoformat(),
+        "partition_by": getattr(transfer_request, 'partition_by', None),
+        "file_format": {"type": file_format[0], "compression": file_format[1]},
+        "total_rows": sum(shard["rows"] or 0 for shard in shards),
+        "total_bytes": sum(shard["bytes"] or 0 for shard in shards),
+        "shards": shards,
+    }
+
+    from google.cloud import storage
+    storage_client = storage.Client(project=transfer_request.gcs_project_id)
+    blob = storage_client.bucket(bucket_name).blob(f"{folder}/{MANIFEST_NAME}")
+    blob.upload_from_string(json.dumps(manifest, indent=4), content_type='application/json')
+    print(f"Manifest with {len(shards)} shards written to gs://{bucket_name}/{folder}/{MANIFEST_NAME}")
+    return f"gs://{bucket_name}/{folder}/{MANIFEST_NAME}"
+
+
+def unload_table(cur, transfer_request, table, gcs_path, timer, file_format=None, source_filter=None, params=None,
+                 for_bigquery=None):
+    file_format = file_format or resolve_file_format(transfer_request)
+
+    # Copy data from Snowflake to GCS
+    with timer.phase('copy'):
+        try:
+            cur.execute(build_copy_sql(transfer_request, table, gcs_path, file_format, source_filter, for_bigquery),
+                        params)
+            query_id = cur.sfqid
+            copy_result = fetch_result(cur)
+            print(f"Data copied from Snowflake table '{table}' to GCS successfully.")
+        except Exception as e:
+            print(f"An error occurred while copying data: {e}")
+            # The stage may have been changed behind our back; check it again next time
+            forget_provisioning(transfer_request.snowflake_account)
+            raise TransferError(f"An error occurred while copying data: {e}")
+
+    metrics.observe_unload('stage', copy_totals(copy_result), timer.phases['copy'])
+    result = {
+        "gcs_uri": f"gs://{transfer_request.gcs_bucket_name}/{gcs_path}",
+        "file_format": {"type": file_format[0], "compression": file_format[1]},
+        "copy_result": copy_result,
+        "unload": unload_stats(copy_result, query_id, timer.phases['copy']),
+    }
+
+    shards = list_shards(transfer_request, gcs_path, copy_result)
+    if shards:
+        result["shards"] = shards
+    if getattr(transfer_request, 'write_manifest', False):
+        with timer.phase('manifest'):
+            result["manifest_uri"] = write_manifest(transfer_request, table, gcs_path, shards, file_format)
+
+    return result
+
+
+def load_table(transfer_request, mapping, table, unloaded, timer):
+    # Load what one unload produced into the BigQuery table the mapping names for it
+    if not unloaded.get("copy_result") or not copy_totals(unloaded["copy_result"])["rows_unloaded"]:
+        return None
+    uris = [shard["uri"] for shard in unloaded.get("shards") or []] or [f"{unloaded['gcs_uri']}*"]
+    target = resolve_target(mapping, transfer_request.snowflake_database, transfer_request.snowflake_schema, table)
+    write_disposition = write_disposition_for(getattr(transfer_request, 'gbq_write_mode', None)
+                                              or mapping.get("gbq_write_mode"))
+    # Both unload paths write comma-separated CSV, whatever delimiter the mapping names
+    with timer.phase('load'):
+        return load_shards(transfer_request.gcs_project_id, target, uris, unloaded["file_format"]["type"],
+                           write_disposition, ',')
+
+
+def format_watermark(value):
+    # Stored as text; ISO timestamps and plain numbers both compare correctly once Snowflake casts them back
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value)
+
+
+def read_watermark(cur, transfer_request):
+    # Returns (source key, destination key, stored low mark, current high mark)
+    column = transfer_request.watermark_column
+    source = (f"{transfer_request.snowflake_account}/{transfer_request.snowflake_database}."
+              f"{transfer_request.snowflake_schema}.{transfer_request.snowflake_table}")
+    destination = f"gs://{transfer_request.gcs_bucket_name}/{transfer_request.gcs_folder_name}"
+    low = get_watermark(source, destination, column)
+    cur.execute(f"""
+    SELECT MAX({column})
+    FROM "{transfer_request.snowflake_database}"."{transfer_request.snowflake_schema}"."{transfer_request.snowflake_table}"
+    """)
+    high = cur.fetchone()[0]
+    return source, destination, low, high
+
+
+@metrics.in_flight('transfer')
+def run_transfer(transfer_request, timer=None):
+    timer = timer or PhaseTimer()
+    watermark_column = getattr(transfer_request, 'watermark_column', None)
+    load_to_bigquery = getattr(transfer_request, 'load_to_bigquery', False)
+
+    # Read the mapping before any warehouse work so a bad mapping fails fast
+    mapping = None
+    if load_to_bigquery:
+        with timer.phase('mapping'):
+            mapping = read_mapping(transfer_request.gcs_project_id, mapping_uri_for(transfer_request))
+
+    # The warehouse slot is taken before the session, in the same order as batch workers, so a
+    # queued request holds no idle session and the two waits cannot deadlock
+    with unload_slot(transfer_request, timer) as queue_wait:
+        # Create Snowflake connection
+        with timer.phase('connect'):
+            conn = connect(transfer_request)
+
+        cur = conn.cursor()
+        print("Snowflake connection established successfully.")
+
+        try:
+            table = transfer_request.snowflake_table
+            with timer.phase('fingerprint'):
+                stats = read_table_stats(cur, transfer_request, table).get(table)
+                fingerprint = table_fingerprint(stats)
+            if is_unchanged(transfer_request, table, fingerprint):
+                return {
+                    "message": "Skipped, unchanged since the last transfer.",
+                    "skipped": True,
+                    "fingerprint": fingerprint,
+                    "phases": timer.phases,
+                }
+
+            watermark = None
+            source_filter, params = None, None
+            if watermark_column:
+                # Delta mode: only rows past the last exported high-water mark
+                with timer.phase('watermark'):
+                    source, destination, low, high = read_watermark(cur, transfer_request)
+                watermark = {"column": watermark_column, "from": low,
+                             "to": format_watermark(high) if high is not None else low}
+                if high is None or watermark["to"] == low:
+                    return {
+                        "message": "No new rows past the watermark, nothing to copy.",
+                        "watermark": watermark,
+                        "phases": timer.phases,
+                    }
+                source_filter = f"{watermark_column} <= %(watermark_high)s"
+                params = {"watermark_high": high}
+                if low is not None:
+                    source_filter = f"{watermark_column} > %(watermark_low)s AND {source_filter}"
+                    params["watermark_low"] = low
+
+            formatted_datetime = get_formatted_datetime()
+            gcs_path = f"{transfer_request.gcs_folder_name}/{formatted_datetime}/{transfer_request.gcs_file_name}"
+            file_format = resolve_file_format(transfer_request)
+
+            if choose_direct(transfer_request, file_format, (stats or {}).get("bytes")):
+                # Small table: no stage, no COPY INTO, rows go straight from the cursor to GCS
+                with timer.phase('stream'):
+                    try:
+                        result = stream_table(cur, transfer_request, table, gcs_path, file_format, source_filter, params)
+                    except Exception as e:
+                        print(f"An error occurred while streaming data: {e}")
+                        raise TransferError(f"An error occurred while streaming data: {e}")
+                metrics.observe_unload('direct', copy_totals(result["copy_result"]), timer.phases['stream'])
+                result["unload"] = unload_stats(result["copy_result"], cur.sfqid, timer.phases['stream'])
+                result["mode"] = "direct"
+            else:
+                provision_stage(cur, transfer_request, timer)
+                result = unload_table(cur, transfer_request, table, gcs_path, timer, file_format,
+                                      source_filter=source_filter, params=params)
+                result["mode"] = "stage"
+            result["queue_wait_seconds"] = queue_wait
+        finally:
+            cur.close()
+            pool.release(conn)
+
+    # The session goes back to the pool before the BigQuery side runs
+    if load_to_bigquery:
+        try:
+            result["load"] = load_table(transfer_request, mapping, table, result, timer)
+        except Exception as e:
+            print(f"An error occurred while loading into BigQuery: {e}")
+            raise TransferError(f"Data copied to {result['gcs_uri']} but the BigQuery load failed: {e}")
+
+    record_fingerprint(transfer_request, table, fingerprint)
+
+    if watermark:
+        # Only advance the mark once the rows up to it are safely exported
+        set_watermark(source, destination, watermark_column, watermark["to"])
+        result["watermark"] = watermark
+
+    if not result["unload"]["rows_unloaded"]:
+        result["message"] = f"No rows were unloaded from {table}; nothing was written to GCS."
+    elif result.get("load"):
+        result["message"] = f"Data copied from Snowflake to GCS and loaded into {result['load']['table_id']} successfully."
+    else:
+        result["message"] = "Data copied from Snowflake to GCS successfully."
+    result["phases"] = timer.phases
+    return result
+
+
+def read_table_stats(cur, transfer_request, table=None):
+    # Size and change information for the schema's tables, or a single table
+    sql = f"""
+    SELECT TABLE_NAME, BYTES, ROW_COUNT, LAST_ALTERED
+    FROM "{transfer_request.snowflake_database}".INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = %(schema)s AND TABLE_TYPE = 'BASE TABLE'
+    """
+    params = {"schema": transfer_request.snowflake_schema}
+    if table is not None:
+        sql += " AND TABLE_NAME = %(table)s"
+        params["table"] = table
+    cur.execute(sql, params)
+    return {row["table_name"]: row for row in fetch_result(cur)}
+
+
+def table_fingerprint(stats):
+    if not stats:
+        return None
+    return {
+        "last_altered": str(stats.get("last_altered")),
+        "row_count": stats.get("row_count"),
+        "bytes": stats.get("bytes"),
+    }
+
+
+def fingerprint_keys(transfer_request, table, file_format):
+    # Anything that changes what a run produces counts as a new destination and is always
+    # exported: bucket, folder, file name, format, watermark column and the BigQuery load
+    # target and mode, so an unload-only run never makes a later loading run skip its load
+    source = (f"{transfer_request.snowflake_account}/{transfer_request.snowflake_database}."
+              f"{transfer_request.snowflake_schema}.{table}")
+    destination = (f"gs://{transfer_request.gcs_bucket_name}/{transfer_request.gcs_folder_name}"
+                   f"/{getattr(transfer_request, 'gcs_file_name', None) or ''}"
+                   f"#{file_format[0]}_{file_format[1]}")
+    watermark_column = getattr(transfer_request, 'watermark_column', None)
+    if watermark_column:
+        destination += f"#watermark={watermark_column}"
+    if getattr(transfer_request, 'load_to_bigquery', False):
+        write_mode = getattr(transfer_request, 'gbq_write_mode', None) or 'mapping'
+        destination += (f"#bq={transfer_request.gcs_project_id}:{mapping_uri_for(transfer_request)}"
+                        f":{write_mode}")
+    return source, destination
+
+
+def is_unchanged(transfer_request, table, fingerprint):
+    if fingerprint is None or getattr(transfer_request, 'force', False):
+        return False
+    source, destination = fingerprint_keys(transfer_request, table, resolve_file_format(transfer_request))
+    return get_fingerprint(source, destination) == fingerprint
+
+
+def record_fingerprint(transfer_request, table, fingerprint):
+    if fingerprint is not None:
+        source, destination = fingerprint_keys(transfer_request, table, resolve_file_format(transfer_request))
+        set_fingerprint(source, destination, fingerprint)
+
+
+def list_tables_by_size(cur, transfer_request, tables=None):
+    # Largest tables first so the longest unloads start earliest and the batch finishes sooner
+    stats = read_table_stats(cur, transfer_request)
+    if tables is None:
+        tables = list(stats)
+    ordered = sorted(tables, key=lambda table: (stats.get(table) or {}).get("bytes") or 0, reverse=True)
+    return [(table, stats.get(table) or {}) for table in ordered]
+
+
+def new_run_id():
+    # Sorts by start time and names the GCS folder the run writes under
+    return f"{get_formatted_datetime()}_{uuid.uuid4().hex[:8]}"
+
+
+def claim_run(run_id):
+    # A run is resumed by at most one job of this process at a time
+    with _active_runs_lock:
+        if run_id in _active_runs:
+            return False
+        _active_runs.add(run_id)
+        return True
+
+
+def release_run(run_id):
+    with _active_runs_lock:
+        _active_runs.discard(run_id)
+
+
+def run_record_object(folder_name, run_id):
+    # The run record sits next to the shards, under the run's timestamped prefix
+    return f"{folder_name}/{run_id.rsplit('_', 1)[0]}/migration_run_{run_id}.json"
+
+
+def save_run_record(batch_request, run_id):
+    # Copies the local record to GCS; the SQLite file does not outlive a Cloud Run instance
+    from google.cloud import storage
+
+    object_name = run_record_object(batch_request.gcs_folder_name, run_id)
+    try:
+        with _run_record_lock:
+            run = get_run(run_id)
+            storage_client = storage.Client(project=batch_request.gcs_project_id)
+            blob = storage_client.bucket(batch_request.gcs_bucket_name).blob(object_name)
+            blob.upload_from_string(json.dumps(run, default=str), content_type='application/json')
+    except Exception as e:
+        print(f"Could not save the record of run {run_id} to gs://{batch_request.gcs_bucket_name}/{object_name}: {e}")
+
+
+def find_run(run_id, project_id=None, bucket_name=None, folder_name=None):
+    # Local record, or the GCS copy when the caller says where the run wrote and that copy is
+    # newer, e.g. after the container was recycled or when another instance did the work
+    run = get_run(run_id)
+    if not (bucket_name and folder_name):
+        return run
+    from google.cloud import storage
+
+    storage_client = storage.Client(project=project_id)
+    blob = storage_client.bucket(bucket_name).blob(run_record_object(folder_name, run_id))
+    if not blob.exists():
+        return run
+    saved = json.loads(blob.download_as_bytes())
+    if run is None or saved["updated_at"] > run["updated_at"]:
+        put_run(saved)
+        run = get_run(run_id)
+    return run
+
+
+def run_finished(entry, load_to_bigquery):
+    # Tables in these states are not touched again when the run is resumed
+    return entry["state"] in ('loaded', 'skipped') or (entry["state"] == 'unloaded' and not load_to_bigquery)
+
+
+@metrics.in_flight('batch')
+def run_batch_transfer(batch_request, progress, timer=None, run_id=None):
+    # Every table's state is checkpointed under run_id; calling this again with the id of an
+    # interrupted run only does what is left and loads shards that were already unloaded
+    timer = timer or PhaseTimer()
+    run_id = run_id or new_run_id()
+    run = get_run(run_id)
+    formatted_datetime = run["timestamp"] if run else run_id.rsplit('_', 1)[0]
+    load_to_bigquery = getattr(batch_request, 'load_to_bigquery', False)
+    mapping = None
+    try:
+        if load_to_bigquery:
+            with timer.phase('mapping'):
+                mapping = read_mapping(batch_request.gcs_project_id, mapping_uri_for(batch_request))
+
+        with timer.phase('connect'):
+            conn = connect(batch_request)
+        cur = conn.cursor()
+        try:
+            provision_stage(cur, batch_request, timer)
+            with timer.phase('plan'):
+                if run:
+                    finished = [table for table, entry in run["tables"].items()
+                                if run_finished(entry, load_to_bigquery)]
+                    remaining = [table for table in run["tables"] if table not in finished]
+                    plan = list_tables_by_size(cur, batch_request, remaining) if remaining else []
+                else:
+                    finished = []
+                    plan = list_tables_by_size(cur, batch_request, batch_request.snowflake_tables)
+                    options = {name: value for name, value in vars(batch_request).items()
+                               if name not in SECRET_FIELDS}
+                    create_run(run_id, options, formatted_datetime, [table for table, _ in plan])
+        finally:
+            cur.close()
+            pool.release(conn)
+        set_run_state(run_id, 'running')
+        save_run_record(batch_request, run_id)
+
+        def checkpoint(table, state, **details):
+            # 'unloading' stays local: a resume treats it like pending either way
+            set_table_state(run_id, table, state, **details)
+            if state != 'unloading':
+                save_run_record(batch_request, run_id)
+
+        # max_workers only asks; the warehouse's unload limit decides how many tables unload at once
+        warehouse_limit = scheduler.limit_for(batch_request.snowflake_warehouse)
+        concurrent_unloads = min(batch_request.max_workers, warehouse_limit)
+        if concurrent_unloads < batch_request.max_workers:
+            print(f"Run {run_id} asked for {batch_request.max_workers} workers; warehouse "
+                  f"{batch_request.snowflake_warehouse} allows {warehouse_limit} unloads at once.")
+
+        pending = queue.Queue()
+        for table, stats in plan:
+            saved = run["tables"][table] if run else None
+            progress[table] = {"state": "pending", "bytes": stats.get("bytes"), "row_count": stats.get("row_count")}
+            # Shards written before the interruption are loaded as they are instead of unloaded again
+            reuse = saved["result"] if saved and saved["state"] in ('unloaded', 'failed') else None
+            pending.put((table, table_fingerprint(stats), reuse))
+
+        def worker():
+            # Each worker runs one Snowflake session at a time and drains the shared queue
+            while True:
+                try:
+                    table, fingerprint, reuse = pending.get_nowait()
+                except queue.Empty:
+                    return
+                entry = progress[table]
+                if not reuse and is_unchanged(batch_request, table, fingerprint):
+                    entry["state"] = "skipped"
+                    entry["message"] = "Skipped, unchanged since the last transfer."
+                    checkpoint(table, 'skipped')
+                    continue
+                table_timer = PhaseTimer()
+                try:
+                    if reuse:
+                        entry.update(reuse)
+                        entry["reused"] = True
+                    else:
+                        entry["state"] = "queued"
+                        entry["message"] = (f"Waiting for one of {warehouse_limit} unload slots on warehouse "
+                                            f"{batch_request.snowflake_warehouse}.")
+                        # Wait for the warehouse before opening a session so queued tables do not hold one idle
+                        with unload_slot(batch_request, table_timer) as queue_wait:
+                            entry["state"] = "running"
+                            entry.pop("message", None)
+                            entry["queue_wait_seconds"] = queue_wait
+                            checkpoint(table, 'unloading')
+                            with table_timer.phase('connect'):
+                                conn = connect(batch_request)
+                            try:
+                                gcs_path = f"{batch_request.gcs_folder_name}/{formatted_datetime}/{table}/{table}"
+                                cur = conn.cursor()
+                                try:
+                                    unloaded = unload_table(cur, batch_request, table, gcs_path, table_timer)
+                                finally:
+                                    cur.close()
+                            finally:
+                                pool.release(conn)
+                        entry.update(unloaded)
+                        checkpoint(table, 'unloaded', result=unloaded)
+                    if load_to_bigquery:
+                        entry["state"] = "loading"
+                        entry["load"] = load_table(batch_request, mapping, table, entry, table_timer)
+                        checkpoint(table, 'loaded')
+                    record_fingerprint(batch_request, table, fingerprint)
+                    entry["state"] = "succeeded"
+                except Exception as e:
+                    entry["state"] = "failed"
+                    entry["error"] = str(e)
+                    checkpoint(table, 'failed', error=str(e))
+                entry["phases"] = table_timer.phases
+
+        workers = min(batch_request.max_workers, len(plan)) or 1
+        with timer.phase('unload'):
+            threads = [threading.Thread(target=worker, name=f"unload-{i}") for i in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        failed = [table for table, entry in progress.items() if entry["state"] == "failed"]
+        skipped = [table for table, entry in progress.items() if entry["state"] == "skipped"]
+        set_run_state(run_id, 'failed' if failed else 'succeeded')
+        save_run_record(batch_request, run_id)
+    except Exception:
+        if get_run(run_id) is not None:
+            set_run_state(run_id, 'failed')
+            save_run_record(batch_request, run_id)
+        raise
+    finally:
+        release_run(run_id)
+
+    copied = len(plan) - len(failed) - len(skipped)
+    message = f"Copied {copied} of {len(plan)} tables from Snowflake to GCS, {len(skipped)} unchanged."
+    if finished:
+        message += f" {len(finished)} tables were already done before the run was resumed."
+    return {
+        "message": message,
+        "run_id": run_id,
+        "gcs_prefix": f"gs://{batch_request.gcs_bucket_name}/{batch_request.gcs_folder_name}/{formatted_datetime}/",
+        "failed_tables": failed,
+        "skipped_tables": skipped,
+        "resumed_tables": finished,
+        "concurrent_unloads": concurrent_unloads,
+        "warehouse_unload_limit": warehouse_limit,
+        "phases": timer.phases,
+    }
+
+
+@metrics.in_flight('compare')
+def run_format_comparison(transfer_request, variants=None, load_dataset=None, timer=None):
+    # Unload the same table once per format and report size and timings side by side
+    timer = timer or PhaseTimer()
+    variants = variants or COMPARE_FORMATS
+    formatted_datetime = get_formatted_datetime()
+    table = transfer_request.snowflake_table
+
+    # One warehouse slot for all variants, taken before the session as in run_transfer
+    with unload_slot(transfer_request, timer) as queue_wait:
+        with timer.phase('connect'):
+            conn = connect(transfer_request)
+        cur = conn.cursor()
+        results = []
+        try:
+            provision_stage(cur, transfer_request, timer)
+            for file_type, codec in variants:
+                variant = f"{file_type}_{codec}".lower()
+                gcs_path = f"{transfer_request.gcs_folder_name}/{formatted_datetime}/compare/{variant}/{table}"
+                variant_timer = PhaseTimer()
+                unloaded = unload_table(cur, transfer_request, table, gcs_path, variant_timer, (file_type, codec),
+                                        for_bigquery=bool(load_dataset))
+                totals = copy_totals(unloaded["copy_result"])
+                entry = {
+                    "file_format": unloaded["file_format"],
+                    "gcs_uri": unloaded["gcs_uri"],
+                    "rows_unloaded": totals["rows_unloaded"],
+                    "bytes_written": totals["output_bytes"],
+                    "unload_seconds": variant_timer.phases['copy'],
+                }
+                if load_dataset:
+                    target = f"{load_dataset}.{table}_{variant}"
+                    load_start = time.perf_counter()
+                    load_uris(transfer_request.gcs_project_id, target, [f"{unloaded['gcs_uri']}*"], file_type,
+                              'WRITE_TRUNCATE')
+                    entry["bigquery_table"] = target
+                    entry["load_seconds"] = round(time.perf_counter() - load_start, 3)
+                results.append(entry)
+        finally:
+            cur.close()
+            pool.release(conn)
+
+    return {
+        "message": f"Unloaded {table} in {len(results)} formats.",
+        "results": results,
+        "queue_wait_seconds": queue_wait,
+        "phases": timer.phases,
+    }